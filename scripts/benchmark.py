@@ -0,0 +1,226 @@
+import argparse
+import importlib
+import json
+import jsoncodec
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import normalize
+import process
+from cidrstore import CidrStore, MAX_PREFIXLEN, format_network, merge_properties
+from instrumentation import peak_rss
+
+COUNTRIES = [
+    ("US", "USA", "US-CA", "San Jose"),
+    ("DE", "DEU", "DE-HE", "Frankfurt"),
+    ("GB", "GBR", "GB-LND", "London"),
+    ("NL", "NLD", "NL-NH", "Amsterdam"),
+    ("JP", "JPN", "JP-13", "Tokyo"),
+    ("BR", "BRA", "BR-SP", "São Paulo"),
+    ("AU", "AUS", "AU-NSW", "Sydney"),
+    ("IN", "IND", "IN-MH", "Mumbai"),
+]
+
+PRIVATE_NETWORKS = {4: [(0x0A000000, 8), (0xAC100000, 12), (0xC0A80000, 16)], 6: [(0xFC << 120, 7)]}
+
+# Prefix lengths that top-level allocations are drawn from
+ALLOCATION_PREFIXLENS = {4: [12, 14, 16, 18, 20], 6: [28, 29, 32, 36]}
+
+# Stages faster than this in the baseline are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.05
+
+
+def generate(count, version, seed):
+    # Yield geofeed rows with nested subnets, duplicated CIDRs with conflicting data, private networks and a share
+    # of 3-letter country codes, roughly matching what the real sources publish
+    rng = random.Random(seed)
+    max_prefixlen = MAX_PREFIXLEN[version]
+    produced = 0
+
+    while produced < count:
+        if rng.random() < 0.01:
+            base, base_prefixlen = rng.choice(PRIVATE_NETWORKS[version])
+            prefixlen = base_prefixlen + rng.randint(0, 8)
+            network = base | (rng.getrandbits(prefixlen - base_prefixlen) << (max_prefixlen - prefixlen))
+        else:
+            prefixlen = rng.choice(ALLOCATION_PREFIXLENS[version])
+            network = rng.getrandbits(prefixlen) << (max_prefixlen - prefixlen)
+            if version == 6:
+                # Move allocations into 2000::/3 and clear the host bits the shift moved prefix bits into
+                network = ((0x2 << 124) | (network >> 4)) & ~((1 << (max_prefixlen - prefixlen)) - 1)
+
+        country = rng.choice(COUNTRIES)
+        stack = [(network, prefixlen, country, 0)]
+        while stack and produced < count:
+            network, prefixlen, country, depth = stack.pop()
+            country_code = country[1] if rng.random() < 0.1 else country[0]
+            yield f"{format_network(version, network, prefixlen)},{country_code},{country[2]},{country[3]},"
+            produced += 1
+
+            # A few CIDRs are published twice with different data, as happens between overlapping sources
+            if rng.random() < 0.02 and produced < count:
+                yield f"{format_network(version, network, prefixlen)},{country[0]},{country[2]},Elsewhere,"
+                produced += 1
+
+            # Nest subnets a few levels deep, most keep their parent's location and some move to another country
+            if depth < 3 and prefixlen + 8 <= max_prefixlen:
+                for _ in range(rng.randint(0, 4)):
+                    child_prefixlen = prefixlen + rng.randint(2, 8)
+                    offset = rng.getrandbits(child_prefixlen - prefixlen) << (max_prefixlen - child_prefixlen)
+                    child_country = country if rng.random() < 0.7 else rng.choice(COUNTRIES)
+                    stack.append((network | offset, child_prefixlen, child_country, depth + 1))
+
+
+def measure(stage, results, trace_memory, function):
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+    value = function()
+    elapsed_time = time.perf_counter() - start_time
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+    else:
+        peak = peak_rss()
+    results.append({"stage": stage, "seconds": elapsed_time, "peak_bytes": peak})
+    return value
+
+
+def run(size, version, seed, trace_memory, work_dir):
+    geofeed = importlib.import_module("parse-geofeed")
+    results = []
+
+    geofeed_csv = os.path.join(work_dir, f"synthetic-{version}-{size}-geofeed.csv")
+    with open(geofeed_csv, "w", encoding="utf-8") as file:
+        for line in generate(size, version, seed):
+            file.write(line + "\n")
+
+    records = measure("parse", results, trace_memory, lambda: list(geofeed.records(geofeed_csv)))
+
+    def merge():
+        store = CidrStore()
+        store.update(records, merge_properties, os.path.basename(geofeed_csv))
+        return store
+
+    store = measure("merge", results, trace_memory, merge)
+    measure("sort", results, trace_memory, lambda: sorted(range(len(store)), key=store.prefixlen.__getitem__))
+    result = measure("resolve", results, trace_memory, lambda: list(process.resolve(store, workers=1)))
+
+    json_file = os.path.join(work_dir, f"synthetic-{version}-{size}.json")
+
+    measure("serialize", results, trace_memory, lambda: jsoncodec.write_items(result, json_file))
+
+    for entry in results:
+        entry.update({"size": size, "version": version, "records": len(records), "kept": len(result)})
+    return results
+
+
+def compare(results, baseline_file, tolerance):
+    with open(baseline_file, "r", encoding="utf-8") as file:
+        baseline = {
+            (entry["size"], entry["version"], entry["stage"]): entry for entry in json.load(file)["results"]
+        }
+
+    regressions = 0
+    for entry in results:
+        previous = baseline.get((entry["size"], entry["version"], entry["stage"]))
+        if previous is None or previous["seconds"] < MIN_COMPARED_SECONDS:
+            continue
+        if entry["seconds"] > previous["seconds"] * (1 + tolerance):
+            regressions += 1
+            print(
+                f"Regression: IPv{entry['version']} {entry['size']:,} {entry['stage']} took {entry['seconds']:.2f}s "
+                f"against {previous['seconds']:.2f}s in the baseline"
+            )
+    return regressions
+
+
+def check_scaling(results, max_growth):
+    # Every stage should be close to linear, so the time per record at the largest size is compared with the smallest.
+    # This catches quadratic behaviour that a baseline recorded with the same behaviour never would.
+    by_stage = {}
+    for entry in results:
+        by_stage.setdefault((entry["version"], entry["stage"]), []).append(entry)
+
+    regressions = 0
+    for (version, stage), entries in by_stage.items():
+        smallest = min(entries, key=lambda entry: entry["size"])
+        largest = max(entries, key=lambda entry: entry["size"])
+        if largest is smallest or largest["seconds"] < MIN_COMPARED_SECONDS or not smallest["seconds"]:
+            continue
+        growth = (largest["seconds"] / largest["records"]) / (smallest["seconds"] / smallest["records"])
+        if growth > max_growth:
+            regressions += 1
+            print(
+                f"Regression: IPv{version} {stage} took {growth:.1f}x as long per record at {largest['size']:,} as at "
+                f"{smallest['size']:,}"
+            )
+    return regressions
+
+
+def benchmark(
+    sizes, versions, output_file, seed=0, trace_memory=False, baseline_file=None, tolerance=0.25, max_growth=2.0
+):
+    if trace_memory:
+        tracemalloc.start()
+
+    # The ISO 3166 tables are loaded on first use, which shouldn't count against the first resolve timing
+    normalize.tables()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for version in versions:
+            for size in sizes:
+                for entry in run(size, version, seed, trace_memory, work_dir):
+                    results.append(entry)
+                    print(
+                        f"IPv{version} {size:>10,} {entry['stage']:<10} {entry['seconds']:8.2f}s "
+                        f"{entry['peak_bytes'] / 1048576:10.1f} MiB"
+                    )
+
+    with open(output_file, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "python": platform.python_implementation() + " " + platform.python_version(),
+                "seed": seed,
+                "trace_memory": trace_memory,
+                "results": results,
+            },
+            file,
+            indent=0,
+        )
+
+    regressions = check_scaling(results, max_growth)
+    if baseline_file:
+        regressions += compare(results, baseline_file, tolerance)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated CIDR counts to generate")
+    parser.add_argument("--versions", default="4,6", help="comma separated IP versions to benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument("--output", default="benchmark.json", help="path to output the machine-readable results")
+    parser.add_argument("--trace-memory", action="store_true", help="measure per-stage peak memory with tracemalloc")
+    parser.add_argument("--baseline", help="previous results to compare against, exits non-zero on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument(
+        "--max-growth", type=float, default=2.0, help="allowed growth in time per record from the smallest size"
+    )
+    args = parser.parse_args()
+
+    benchmark(
+        [int(size) for size in args.sizes.split(",")],
+        [int(version) for version in args.versions.split(",")],
+        args.output,
+        args.seed,
+        args.trace_memory,
+        args.baseline,
+        args.tolerance,
+        args.max_growth,
+    )
@@ -0,0 +1,235 @@
+import argparse
+import collections
+import glob
+import hashlib
+import importlib
+import itertools
+import json
+import os
+import struct
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cidrstore
+import extsort
+import instrumentation
+import jsoncodec
+import stats
+from cidrstore import CidrStore, LOW_BITS, merge_properties
+from instrumentation import Metrics, peak_rss
+
+# Every source in the order it is merged, the first writer wins when two sources disagree on a CIDR.
+# Each entry is (parser module, input file pattern relative to the data directory), dual-stack sources are read once
+# and their records are routed to the IPv4 or IPv6 output by version.
+SOURCES = [
+    ("parse-pingdom", "feed.xml"),
+    ("parse-hetrix", "hetrix.txt"),
+    ("parse-updown", "updown.json"),
+    ("parse-statuscake", "statuscake.json"),
+    ("parse-oracle", "oracle-ranges.json"),
+    ("parse-geofeed", "*-geofeed.csv"),
+]
+
+OUTPUT_FILES = {4: "IPv4.json", 6: "IPv6.json"}
+
+# Cached parse results that haven't been used by a build for this many days are evicted
+CACHE_MAX_AGE_DAYS = 7
+
+# Parsed sources are written to record files: one fixed-width record per network, then the distinct property records
+# as a JSON array and a trailer with the record count and the array's length in bytes
+RECORD = struct.Struct("<BQQBI")  # version, start (high and low 64 bits), prefix length, property id
+TRAILER = struct.Struct("<QQ")
+
+
+def find_sources(data_dir):
+    # Resolve SOURCES into (parser module, input file) jobs in merge priority order
+    jobs = []
+    for module_name, pattern in SOURCES:
+        for input_file in sorted(glob.glob(os.path.join(data_dir, pattern))):
+            jobs.append((module_name, input_file))
+    return jobs
+
+
+def cache_key(module, input_file):
+    # Keyed on the input file's content and the parser's source, which holds its region / hostname mappings,
+    # so editing a mapping, the shared CIDR parsing or the record file format invalidates the cached records
+    digest = hashlib.sha256()
+    for path in (module.__file__, cidrstore.__file__, __file__, input_file):
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return f"{module.__name__}-{digest.hexdigest()}.records"
+
+
+def write_records(records, record_file):
+    # Stream (network, properties) pairs to a record file, only the distinct property records are held in memory
+    property_ids = {}
+    properties = []
+    count = 0
+    with open(record_file, "wb") as file:
+        batch = []
+        for (version, start, prefixlen), entry in records:
+            key = tuple(entry.items())
+            property_id = property_ids.get(key)
+            if property_id is None:
+                property_id = property_ids[key] = len(properties)
+                properties.append(entry)
+            batch.append(RECORD.pack(version, start >> 64, start & LOW_BITS, prefixlen, property_id))
+            count += 1
+            if len(batch) >= extsort.READ_RECORDS:
+                file.write(b"".join(batch))
+                batch.clear()
+        file.write(b"".join(batch))
+
+        table = json.dumps(properties, ensure_ascii=False).encode("utf-8")
+        file.write(table)
+        file.write(TRAILER.pack(count, len(table)))
+    return count
+
+
+def read_trailer(file):
+    file.seek(-TRAILER.size, os.SEEK_END)
+    return TRAILER.unpack(file.read(TRAILER.size))
+
+
+def read_records(record_file):
+    # Yield the (network, properties) pairs of a record file in the order they were parsed. Networks that shared a
+    # property record share one dict again, which the stores intern by value anyway.
+    with open(record_file, "rb") as file:
+        count, table_length = read_trailer(file)
+        file.seek(-(TRAILER.size + table_length), os.SEEK_END)
+        properties = json.loads(file.read(table_length).decode("utf-8"))
+
+        file.seek(0)
+        remaining = count
+        while remaining:
+            block = file.read(RECORD.size * min(remaining, extsort.READ_RECORDS))
+            for version, start_hi, start_lo, prefixlen, property_id in RECORD.iter_unpack(block):
+                yield (version, (start_hi << 64) | start_lo, prefixlen), properties[property_id]
+            remaining -= len(block) // RECORD.size
+
+
+def parse_source(module_name, input_file, cache_dir=None, spill_dir=None):
+    # Runs in a worker process. The records are streamed to a record file, in the cache when there is one, and only
+    # its path is sent back, so neither process ever holds a whole source in memory.
+    start_time = time.time()
+    module = importlib.import_module(module_name)
+
+    if cache_dir is None:
+        descriptor, record_file = tempfile.mkstemp(dir=spill_dir, prefix=f"{module_name}-")
+        os.close(descriptor)
+        count = write_records(module.records(input_file), record_file)
+        return record_file, count, time.time() - start_time, False, peak_rss()
+
+    cache_file = os.path.join(cache_dir, cache_key(module, input_file))
+    try:
+        with open(cache_file, "rb") as file:
+            count, _ = read_trailer(file)
+        # Refresh the entry so eviction only removes results that builds stopped using
+        os.utime(cache_file)
+        return cache_file, count, time.time() - start_time, True, peak_rss()
+    except FileNotFoundError:
+        pass
+
+    # Written under a temporary name first so a concurrent or interrupted build never reads a partial entry
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    count = write_records(module.records(input_file), temp_file)
+    os.replace(temp_file, cache_file)
+    return cache_file, count, time.time() - start_time, False, peak_rss()
+
+
+def evict_cache(cache_dir, max_age_days=CACHE_MAX_AGE_DAYS):
+    cutoff = time.time() - max_age_days * 86400
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+
+def count_conflicts(stores, metrics):
+    # One grouped pass over each store's conflict table, rather than counting inside the merge
+    for store in stores.values():
+        for (_, _, source), count in store.conflict_groups().items():
+            metrics.count("conflicts", count)
+            metrics.count(f"conflicts ({store.source_name(source)})", count)
+
+
+def build(data_dir, output_dir, workers=None, cache_dir=None, metrics=None, conflicts_file=None, stats_file=None):
+    if metrics is None:
+        metrics = Metrics("build")
+
+    with metrics.stage("load") as stage:
+        stores = {
+            version: CidrStore.load(os.path.join(output_dir, filename))
+            for version, filename in OUTPUT_FILES.items()
+        }
+        stage["rows"] = sum(len(store) for store in stores.values())
+
+    jobs = find_sources(data_dir)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Sources are parsed at most this far ahead of the merge, so finished record files don't pile up on disk
+    ahead = 2 * (workers or os.cpu_count() or 1)
+
+    spill = tempfile.TemporaryDirectory(prefix="build-")
+    with spill as spill_dir, ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(jobs)
+        pending = collections.deque()
+
+        def submit():
+            for job in itertools.islice(remaining, ahead - len(pending)):
+                pending.append((job, executor.submit(parse_source, *job, cache_dir, spill_dir)))
+
+        # Results are merged in the fixed source order rather than in completion order,
+        # so the first-writer-wins rule for conflicts gives the same output as a serial run
+        submit()
+        while pending:
+            (module_name, input_file), future = pending.popleft()
+            record_file, count, elapsed_time, cached, worker_peak_rss = future.result()
+            submit()
+            source = os.path.basename(input_file)
+            metrics.record("parse", elapsed_time, count, worker_peak_rss, source=source, cached=cached)
+
+            with metrics.stage("merge", source=source) as stage:
+                for network, properties in read_records(record_file):
+                    stores[network[0]].add_network(*network, properties, merge_properties, source)
+                stage["rows"] = count
+            if cache_dir is None:
+                os.remove(record_file)
+
+            print(f"{source}{' (cached)' if cached else ''}: {count:,} records in {elapsed_time:.2f} seconds")
+
+    if cache_dir is not None:
+        evict_cache(cache_dir)
+
+    count_conflicts(stores, metrics)
+    print(f"{metrics.counters.get('conflicts', 0):,} CIDRs had conflicting data, the first source's was kept.")
+    if conflicts_file is not None:
+        report = {filename: stores[version].conflict_report() for version, filename in OUTPUT_FILES.items()}
+        jsoncodec.dump(report, conflicts_file)
+    if stats_file is not None:
+        stats.save_source_stats(stores, stats_file)
+
+    # The dataset is written once, no matter how many sources were merged into it
+    with metrics.stage("save") as stage:
+        for version, filename in OUTPUT_FILES.items():
+            stores[version].save(os.path.join(output_dir, filename))
+        stage["rows"] = sum(len(store) for store in stores.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_dir", help="path to the directory holding the downloaded sources")
+    parser.add_argument("output_dir", help="path to the directory the IPv4.json and IPv6.json files are written to")
+    parser.add_argument("--workers", type=int, help="number of parser processes (defaults to the CPU count)")
+    parser.add_argument("--cache-dir", help="directory to cache parsed records in, unchanged sources aren't re-parsed")
+    parser.add_argument("--conflicts", help="path to write the conflicting records and their sources to as JSON")
+    parser.add_argument("--source-stats", help="path to write the CIDRs and addresses each source covers to as JSON")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = instrumentation.from_arguments("build", args)
+    build(args.data_dir, args.output_dir, args.workers, args.cache_dir, metrics, args.conflicts, args.source_stats)
+    if args.metrics:
+        metrics.save(args.metrics)
@@ -0,0 +1,188 @@
+import argparse
+import contextlib
+import importlib
+import io
+import ipaddress
+import json
+import os
+import random
+import sys
+import tempfile
+import jsoncodec
+import normalize
+import process
+from benchmark import generate
+from cidrstore import CidrStore, MAX_PREFIXLEN, SHARD_PREFIXLEN, merge_properties, network_end, parse_network
+from instrumentation import Metrics
+
+# (name, process() keyword arguments, what the output must be byte-identical to). Modes that write different CIDRs
+# from the reference are checked for resolving every address the same way instead.
+MODES = [
+    ("default", {}, "reference"),
+    ("--workers 1", {"workers": 1}, "reference"),
+    ("--memory-budget", {"memory_budget": 1 << 16}, "reference"),
+    ("--aggregate", {"aggregated": True}, None),
+    ("--flatten", {"flattened": True}, None),
+    ("--flatten --aggregate", {"flattened": True, "aggregated": True}, "--flatten"),
+    ("--flatten --memory-budget", {"flattened": True, "memory_budget": 1 << 16}, "--flatten"),
+]
+
+
+def synthetic(json_file, version, size, seed):
+    # A merged dataset like build.py writes: the benchmark's nested geofeed rows, plus for IPv4 a few supernets shorter
+    # than the shard prefix, so seeding shards with spanning networks is covered for both versions
+    geofeed = importlib.import_module("parse-geofeed")
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", delete=False) as file:
+        for line in generate(size, version, seed):
+            file.write(line + "\n")
+    store = CidrStore()
+    records = list(geofeed.records(file.name))
+    os.remove(file.name)
+
+    rng = random.Random(seed)
+    if version == 4:
+        for (_, start, _), _ in rng.sample(records, max(1, size // 200)):
+            prefixlen = rng.randint(4, SHARD_PREFIXLEN[4] - 1)
+            network = start >> (32 - prefixlen) << (32 - prefixlen)
+            store.add_network(4, network, prefixlen, {"country_code": rng.choice(["US", "DE", "FR"])}, merge_properties)
+    store.update(records, merge_properties, "synthetic")
+    store.save(json_file)
+
+
+def reference(json_file):
+    # The original process.py's algorithm written out directly: largest networks first, every kept network compared
+    # against every earlier one, with today's country and subdivision normalisation
+    data = jsoncodec.load(json_file)
+    networks = sorted(data.items(), key=lambda item: ipaddress.ip_network(item[0]).num_addresses, reverse=True)
+    result = {}
+    kept = []
+    total_ips = 0
+    for cidr, entry in networks:
+        if not entry:
+            continue
+        network = ipaddress.ip_network(cidr)
+        if network.is_private:
+            continue
+        entry = normalize.normalize(entry)
+
+        version, start, prefixlen = parse_network(cidr)
+        keep_network = True
+        was_in_subnet = False
+        for kept_version, kept_start, kept_prefixlen, kept_entry in kept:
+            shift = MAX_PREFIXLEN[version] - kept_prefixlen
+            if kept_version == version and kept_prefixlen <= prefixlen and start >> shift == kept_start >> shift:
+                if entry == kept_entry:
+                    keep_network = False
+                else:
+                    keep_network = True
+                    was_in_subnet = True
+
+        if keep_network:
+            result[cidr] = entry
+            kept.append((version, start, prefixlen, entry))
+            if not was_in_subnet:
+                total_ips += network.num_addresses
+    return result, total_ips
+
+
+def most_specific(data):
+    # A lookup of the most specific network covering an address, by trying each prefix length in use from the longest.
+    # It's independent of the trie and sweep code under test.
+    networks = {}
+    for cidr, entry in data.items():
+        networks[parse_network(cidr)] = entry
+    lengths = {4: set(), 6: set()}
+    for version, _, prefixlen in networks:
+        lengths[version].add(prefixlen)
+    lengths = {version: sorted(version_lengths, reverse=True) for version, version_lengths in lengths.items()}
+
+    def lookup(version, address):
+        for prefixlen in lengths[version]:
+            shift = MAX_PREFIXLEN[version] - prefixlen
+            network = (version, address >> shift << shift, prefixlen)
+            if network in networks:
+                return networks[network]
+        return None
+
+    return lookup
+
+
+def resolve_differences(expected, output):
+    # Lookups only change at the first address of a network or the one after its last, so comparing both outputs at
+    # every such boundary compares them at every address
+    points = set()
+    for data in (expected, output):
+        for cidr in data:
+            version, start, prefixlen = parse_network(cidr)
+            points.add((version, start))
+            end = network_end(version, start, prefixlen)
+            if end + 1 < 1 << MAX_PREFIXLEN[version]:
+                points.add((version, end + 1))
+    expected_lookup = most_specific(expected)
+    output_lookup = most_specific(output)
+    return sum(1 for point in points if expected_lookup(*point) != output_lookup(*point))
+
+
+def overlapping(data):
+    networks = sorted(
+        (version, start, network_end(version, start, prefixlen))
+        for version, start, prefixlen in (parse_network(cidr) for cidr in data)
+    )
+    # Sorted by start, a network overlaps an earlier one exactly when it starts before the previous one ends
+    return sum(
+        1
+        for previous, network in zip(networks, networks[1:])
+        if network[0] == previous[0] and network[1] <= previous[2]
+    )
+
+
+def check(versions, size, seed):
+    failures = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        for version in versions:
+            input_file = os.path.join(work_dir, f"input-{version}.json")
+            synthetic(input_file, version, size, seed)
+            expected, expected_ips = reference(input_file)
+            with open(input_file, "r", encoding="utf-8") as file:
+                rows = len(json.load(file))
+            outputs = {"reference": json.dumps(expected, indent=0, ensure_ascii=False).encode("utf-8")}
+
+            for name, options, identical_to in MODES:
+                output_file = os.path.join(work_dir, f"output-{version}.json")
+                with open(input_file, "rb") as source, open(output_file, "wb") as destination:
+                    destination.write(source.read())
+                metrics = Metrics("process")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    process.process(output_file, metrics=metrics, temp_dir=work_dir, **options)
+
+                with open(output_file, "rb") as file:
+                    outputs[name] = file.read()
+                output = json.loads(outputs[name])
+                problems = []
+                if identical_to is not None and outputs[name] != outputs[identical_to]:
+                    problems.append(f"output differs from {identical_to}")
+                if identical_to == "reference":
+                    if metrics.counters.get("total_ips", 0) != expected_ips:
+                        problems.append(f"{metrics.counters.get('total_ips', 0):,} IPs against {expected_ips:,}")
+                else:
+                    differences = resolve_differences(expected, output)
+                    if differences:
+                        problems.append(f"addresses resolve differently from the reference at {differences:,} points")
+                if options.get("flattened") and overlapping(output):
+                    problems.append(f"{overlapping(output):,} overlapping CIDRs")
+
+                status = "ok" if not problems else "FAILED: " + ", ".join(problems)
+                print(f"IPv{version} {name:<26} {rows:>8,} rows {len(output):>8,} CIDRs  {status}")
+                failures += bool(problems)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=5000, help="synthetic geofeed rows per IP version")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument("--versions", default="4,6", help="comma separated IP versions to check")
+    args = parser.parse_args()
+
+    if check([int(version) for version in args.versions.split(",")], args.size, args.seed):
+        sys.exit(1)
@@ -0,0 +1,275 @@
+import ipaddress
+import jsoncodec
+from array import array
+from collections import Counter
+
+MAX_PREFIXLEN = {4: 32, 6: 128}
+# The address space is split into shards by this top-level prefix, for parallel overlap resolution and NDJSON seeks
+SHARD_PREFIXLEN = {4: 8, 6: 32}
+LOW_BITS = (1 << 64) - 1
+
+# Sources are tracked as bits of a 64-bit mask on each row
+MAX_SOURCES = 64
+
+
+def parse_network(cidr):
+    # Parse a CIDR string exactly once into (version, start, prefixlen), host bits are masked off
+    network = ipaddress.ip_network(cidr, strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def host_network(address):
+    # The single-address network for an IP, without building an ip_network just to stringify it
+    ip_address = ipaddress.ip_address(address)
+    return ip_address.version, int(ip_address), ip_address.max_prefixlen
+
+
+def format_network(version, start, prefixlen):
+    if version == 4:
+        return f"{ipaddress.IPv4Address(start)}/{prefixlen}"
+    return f"{ipaddress.IPv6Address(start)}/{prefixlen}"
+
+
+def network_end(version, start, prefixlen):
+    return start | ((1 << (MAX_PREFIXLEN[version] - prefixlen)) - 1)
+
+
+def range_networks(version, start, end):
+    # Split an inclusive address range into the fewest CIDRs, taking the largest aligned block each step
+    max_prefixlen = MAX_PREFIXLEN[version]
+    while start <= end:
+        size = (start & -start).bit_length() - 1 if start else max_prefixlen
+        size = min(size, (end - start + 1).bit_length() - 1)
+        yield start, max_prefixlen - size
+        start += 1 << size
+
+
+def merge_properties(existing, new):
+    # The merge shared by every source. Records that agree on every field they both have are combined, so a source
+    # can fill in fields another one left out. None marks a conflict, the store then keeps the existing record.
+    if existing == new:
+        return existing
+    for key, value in existing.items():
+        if key in new and new[key] != value:
+            return None
+    return {**existing, **new}
+
+
+def route(records, stores, merge=None, source=None):
+    # Add each record to the store for its IP version, so one pass over a dual-stack source fills both
+    for network, properties in records:
+        stores[network[0]].add_network(*network, properties, merge, source)
+
+
+def merge_into_files(records, json_files, merge=None, source=None):
+    stores = {version: CidrStore.load(json_file) for version, json_file in json_files.items()}
+    route(records, stores, merge, source)
+
+    # Write the updated data back to the JSON files
+    for version, json_file in json_files.items():
+        stores[version].save(json_file)
+
+
+class CidrStore:
+    # Columnar CIDR storage shared by the parsers and process.py.
+    # Each row is a version, a start address split into two 64-bit halves, a prefix length and an interned property id,
+    # so a record costs a few dozen bytes instead of a dict of dicts keyed on strings.
+    # Rows are deduplicated on their canonical network, which collapses "1.2.3.4/24" into "1.2.3.0/24". They're found
+    # through an open-addressing hash table of row numbers that compares against the columns, so unlike a dict it
+    # holds no key or value objects and costs a few bytes per row.
+    # Each row also carries a bitmask of the sources that asserted it, and records a merge rejected are kept in a
+    # conflict table of (row, kept property id, rejected property id, source index) columns rather than printed.
+    def __init__(self):
+        self.version = array("B")
+        self.start_hi = array("Q")
+        self.start_lo = array("Q")
+        self.prefixlen = array("B")
+        self.props = array("I")
+        self.properties = []
+        self.property_ids = {}
+        self.slots = array("i", [-1]) * 8
+        self.sources = array("Q")
+        self.source_names = []
+        self.source_ids = {}
+        self.conflict_rows = array("I")
+        self.conflict_kept = array("I")
+        self.conflict_rejected = array("I")
+        self.conflict_sources = array("i")
+
+    def __len__(self):
+        return len(self.props)
+
+    def intern(self, properties):
+        key = tuple(properties.items())
+        property_id = self.property_ids.get(key)
+        if property_id is None:
+            property_id = len(self.properties)
+            self.property_ids[key] = property_id
+            self.properties.append(properties)
+        return property_id
+
+    def map_properties(self, function):
+        # Rewrite every distinct property record once and re-intern the results, so records that become identical
+        # share an id afterwards
+        properties = self.properties
+        self.properties = []
+        self.property_ids = {}
+        remap = [self.intern(function(entry)) for entry in properties]
+        self.props = array("I", (remap[property_id] for property_id in self.props))
+        self.conflict_kept = array("I", (remap[property_id] for property_id in self.conflict_kept))
+        self.conflict_rejected = array("I", (remap[property_id] for property_id in self.conflict_rejected))
+
+    def source_index(self, source):
+        # Sources are numbered in the order they're first seen, None is an unnamed source with no bit
+        if source is None:
+            return -1
+        index = self.source_ids.get(source)
+        if index is None:
+            if len(self.source_names) == MAX_SOURCES:
+                raise ValueError(f"A store can track at most {MAX_SOURCES} sources")
+            index = self.source_ids[source] = len(self.source_names)
+            self.source_names.append(source)
+        return index
+
+    def row_sources(self, row):
+        mask = self.sources[row]
+        return [name for index, name in enumerate(self.source_names) if mask >> index & 1]
+
+    def conflict_groups(self):
+        # Number of CIDRs per (kept property id, rejected property id, source index), in a single pass over the table
+        return Counter(zip(self.conflict_kept, self.conflict_rejected, self.conflict_sources))
+
+    def source_name(self, index):
+        return self.source_names[index] if index >= 0 else None
+
+    def conflict_report(self):
+        # Property records are listed once by id and referenced from the groups and individual conflicts
+        referenced = sorted(set(self.conflict_kept) | set(self.conflict_rejected))
+        return {
+            "properties": {str(property_id): self.properties[property_id] for property_id in referenced},
+            "groups": [
+                {"kept": kept, "rejected": rejected, "source": self.source_name(source), "cidrs": count}
+                for (kept, rejected, source), count in self.conflict_groups().most_common()
+            ],
+            "conflicts": [
+                {
+                    "cidr": self.cidr(row),
+                    "kept": kept,
+                    "rejected": rejected,
+                    "source": self.source_name(source),
+                    "asserted_by": self.row_sources(row),
+                }
+                for row, kept, rejected, source in zip(
+                    self.conflict_rows, self.conflict_kept, self.conflict_rejected, self.conflict_sources
+                )
+            ],
+        }
+
+    def start(self, row):
+        return (self.start_hi[row] << 64) | self.start_lo[row]
+
+    def end(self, row):
+        return network_end(self.version[row], self.start(row), self.prefixlen[row])
+
+    def cidr(self, row):
+        return format_network(self.version[row], self.start(row), self.prefixlen[row])
+
+    def get(self, row):
+        return self.properties[self.props[row]]
+
+    def slot(self, version, start, prefixlen, slots=None):
+        # Linear probing from the network's hash, returns the slot holding its row or the empty slot it belongs in
+        if slots is None:
+            slots = self.slots
+        mask = len(slots) - 1
+        start_hi = start >> 64
+        start_lo = start & LOW_BITS
+        i = hash((start, prefixlen, version)) & mask
+        while True:
+            row = slots[i]
+            if row < 0 or (
+                self.start_lo[row] == start_lo
+                and self.prefixlen[row] == prefixlen
+                and self.start_hi[row] == start_hi
+                and self.version[row] == version
+            ):
+                return i
+            i = (i + 1) & mask
+
+    def grow(self):
+        # Double the table once it's two thirds full, re-inserting every row
+        slots = array("i", [-1]) * (len(self.slots) * 2)
+        for row in range(len(self.props)):
+            slots[self.slot(self.version[row], self.start(row), self.prefixlen[row], slots)] = row
+        self.slots = slots
+
+    def find(self, version, start, prefixlen):
+        row = self.slots[self.slot(version, start, prefixlen)]
+        return row if row >= 0 else None
+
+    def add_network(self, version, start, prefixlen, properties, merge=None, source=None):
+        source_index = self.source_index(source)
+        bit = 1 << source_index if source_index >= 0 else 0
+        slot = self.slot(version, start, prefixlen)
+        row = self.slots[slot]
+        if row >= 0:
+            self.sources[row] |= bit
+            # Without a merge function the first writer wins silently
+            if merge is not None:
+                merged = merge(self.properties[self.props[row]], properties)
+                if merged is None:
+                    self.conflict_rows.append(row)
+                    self.conflict_kept.append(self.props[row])
+                    self.conflict_rejected.append(self.intern(properties))
+                    self.conflict_sources.append(source_index)
+                else:
+                    self.props[row] = self.intern(merged)
+            return row
+
+        row = len(self.props)
+        self.slots[slot] = row
+        self.version.append(version)
+        self.start_hi.append(start >> 64)
+        self.start_lo.append(start & LOW_BITS)
+        self.prefixlen.append(prefixlen)
+        self.props.append(self.intern(properties))
+        self.sources.append(bit)
+        if 3 * len(self.props) > 2 * len(self.slots):
+            self.grow()
+        return row
+
+    def add(self, cidr, properties, merge=None, source=None):
+        return self.add_network(*parse_network(cidr), properties, merge, source)
+
+    def update(self, records, merge=None, source=None):
+        # Add (network, properties) pairs as produced by the parsers' records() generators
+        for network, properties in records:
+            self.add_network(*network, properties, merge, source)
+
+    def rows(self):
+        for row in range(len(self.props)):
+            yield row, self.version[row], self.start(row), self.prefixlen[row], self.props[row]
+
+    def items(self):
+        for row in range(len(self.props)):
+            yield self.cidr(row), self.properties[self.props[row]]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, data, merge=None):
+        store = cls()
+        for cidr, properties in data.items():
+            store.add(cidr, properties, merge)
+        return store
+
+    @classmethod
+    def load(cls, json_file, merge=None):
+        try:
+            return cls.from_dict(jsoncodec.load(json_file), merge)
+        except FileNotFoundError:
+            return cls()  # File doesn't exist yet, ignore and proceed with an empty store
+
+    def save(self, json_file):
+        jsoncodec.write_items(self.items(), json_file)
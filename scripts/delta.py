@@ -0,0 +1,76 @@
+import argparse
+import jsoncodec
+from cidrstore import CidrStore
+
+
+def sorted_rows(store):
+    # Row numbers ordered by (version, start address, prefix length)
+    return sorted(
+        range(len(store)),
+        key=lambda row: (store.version[row], store.start(row), store.prefixlen[row]),
+    )
+
+
+def field_changes(old, new):
+    changes = {}
+    for key in list(old) + [key for key in new if key not in old]:
+        if old.get(key) != new.get(key):
+            changes[key] = [old.get(key), new.get(key)]
+    return changes
+
+
+def compare(old_store, new_store):
+    added = {}
+    removed = []
+    changed = {}
+
+    old_rows = sorted_rows(old_store)
+    new_rows = sorted_rows(new_store)
+
+    # A single merge walk over both sorted row lists, so the comparison is linear after the sort
+    i = j = 0
+    while i < len(old_rows) or j < len(new_rows):
+        old_key = new_key = None
+        if i < len(old_rows):
+            row = old_rows[i]
+            old_key = (old_store.version[row], old_store.start(row), old_store.prefixlen[row])
+        if j < len(new_rows):
+            row = new_rows[j]
+            new_key = (new_store.version[row], new_store.start(row), new_store.prefixlen[row])
+
+        if new_key is None or (old_key is not None and old_key < new_key):
+            removed.append(old_store.cidr(old_rows[i]))
+            i += 1
+        elif old_key is None or new_key < old_key:
+            added[new_store.cidr(new_rows[j])] = new_store.get(new_rows[j])
+            j += 1
+        else:
+            old_properties = old_store.get(old_rows[i])
+            new_properties = new_store.get(new_rows[j])
+            if old_properties != new_properties:
+                changed[new_store.cidr(new_rows[j])] = field_changes(old_properties, new_properties)
+            i += 1
+            j += 1
+
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def delta(old_json_file, new_json_file, delta_file):
+    delta_data = compare(CidrStore.load(old_json_file), CidrStore.load(new_json_file))
+
+    jsoncodec.dump(delta_data, delta_file)
+
+    print(
+        f"{len(delta_data['added']):,} CIDRs were added, {len(delta_data['removed']):,} removed "
+        f"and {len(delta_data['changed']):,} changed since the previous release."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old_json_file", help="path to the previous release's JSON file")
+    parser.add_argument("new_json_file", help="path to the newly processed JSON file")
+    parser.add_argument("delta_file", help="path to output delta JSON file")
+    args = parser.parse_args()
+
+    delta(args.old_json_file, args.new_json_file, args.delta_file)
@@ -0,0 +1,159 @@
+import argparse
+import csv
+import random
+import time
+from cidrstore import CidrStore, network_end, parse_network
+from rangeindex import RangeIndex, format_address, parse_address
+
+# Fields scored against the candidate, only those present in a test record are compared
+FIELDS = ["country_code", "subdivision_1_iso_code", "city", "postal_code"]
+
+
+def sample_addresses(start, end, count, rng):
+    # Always test both edges of a range, the rest are drawn uniformly from inside it
+    if end - start + 1 <= count:
+        return list(range(start, end + 1))
+    return [start, end] + [rng.randint(start + 1, end - 1) for _ in range(count - 2)]
+
+
+def normalize(value):
+    return value.strip().casefold() if isinstance(value, str) else value
+
+
+def subdivision_code(value):
+    # Candidates often store "CA" where the test data has "US-CA", only the part after the country is compared
+    return normalize(value).split("-", 1)[-1] if value else value
+
+
+class MmdbCandidate:
+    def __init__(self, mmdb_file):
+        try:
+            import maxminddb
+        except ImportError:
+            raise SystemExit("Evaluating a MaxMind DB requires the maxminddb package (pip install maxminddb)")
+        self.reader = maxminddb.open_database(mmdb_file, maxminddb.MODE_MMAP)
+
+    def lookup_batch(self, queries):
+        results = []
+        for version, address in queries:
+            record = self.reader.get(format_address(version, address)) or {}
+            subdivisions = record.get("subdivisions") or [{}]
+            results.append(
+                {
+                    "country_code": record.get("country", {}).get("iso_code"),
+                    "subdivision_1_iso_code": subdivisions[0].get("iso_code"),
+                    "city": record.get("city", {}).get("names", {}).get("en"),
+                    "postal_code": record.get("postal", {}).get("code"),
+                }
+            )
+        return results
+
+
+class CsvCandidate:
+    # A CSV range file with either a "network" column or "start_ip" and "end_ip" columns, plus any of FIELDS.
+    # Ranges are expected not to overlap, as in the CSV exports of most commercial databases.
+    def __init__(self, csv_file):
+        ranges = {4: [], 6: []}
+        properties = []
+        with open(csv_file, "r", encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                if row.get("network"):
+                    version, start, prefixlen = parse_network(row["network"])
+                    end = network_end(version, start, prefixlen)
+                else:
+                    version, start = parse_address(row["start_ip"])
+                    end = parse_address(row["end_ip"])[1]
+                ranges[version].append((start, end, len(properties)))
+                properties.append({field: row.get(field) or None for field in FIELDS})
+
+        for version_ranges in ranges.values():
+            version_ranges.sort()
+        self.index = RangeIndex(ranges, properties)
+
+    def lookup_batch(self, queries):
+        return [result or {} for result in self.index.lookup_batch(queries)]
+
+
+def open_candidate(candidate_file):
+    if candidate_file.endswith(".mmdb"):
+        return MmdbCandidate(candidate_file)
+    return CsvCandidate(candidate_file)
+
+
+def score(expected, actual, totals):
+    for field in FIELDS:
+        if not expected.get(field):
+            continue
+        if field == "subdivision_1_iso_code":
+            matched = subdivision_code(expected[field]) == subdivision_code(actual.get(field))
+        else:
+            matched = normalize(expected[field]) == normalize(actual.get(field))
+        counts = totals.setdefault(field, [0, 0])
+        counts[0] += matched
+        counts[1] += 1
+
+
+def format_scores(totals):
+    cells = []
+    for field in FIELDS:
+        matched, compared = totals.get(field, (0, 0))
+        cells.append(f"{matched / compared:.1%} ({compared:,})" if compared else "-")
+    return " | ".join(cells)
+
+
+def evaluate(json_files, candidate_file, report_file, samples=4, seed=0, batch_size=100000):
+    start_time = time.time()
+    candidate = open_candidate(candidate_file)
+    rng = random.Random(seed)
+
+    overall = {}
+    per_country = {}
+    sampled = 0
+
+    # An address sampled from a supernet may fall in one of its subnets, so the expected answer for every address
+    # comes from the test data's own range index where the most specific network wins
+    test_index = RangeIndex.from_json_files(json_files)
+    pending = []
+
+    def flush():
+        results = candidate.lookup_batch(pending)
+        for expected, actual in zip(test_index.lookup_batch(pending), results):
+            expected = expected or {}
+            score(expected, actual, overall)
+            score(expected, actual, per_country.setdefault(expected.get("country_code") or "??", {}))
+        pending.clear()
+
+    for json_file in json_files:
+        store = CidrStore.load(json_file)
+        for row, version, start, prefixlen, property_id in store.rows():
+            for address in sample_addresses(start, network_end(version, start, prefixlen), samples, rng):
+                pending.append((version, address))
+            sampled += 1
+            if len(pending) >= batch_size:
+                flush()
+    flush()
+
+    elapsed_time = time.time() - start_time
+    header = "| " + " | ".join(["Scope"] + FIELDS) + " |\n|" + " --- |" * (len(FIELDS) + 1) + "\n"
+    with open(report_file, "w", encoding="utf-8") as file:
+        file.write(f"# Accuracy of {candidate_file}\n\n")
+        file.write(f"{sampled:,} test CIDRs sampled with up to {samples} addresses each (seed {seed}).\n\n")
+        file.write(header)
+        file.write(f"| All | {format_scores(overall)} |\n")
+        for country in sorted(per_country):
+            file.write(f"| {country} | {format_scores(per_country[country])} |\n")
+
+    print(f"Overall: {format_scores(overall)}")
+    print(f"Evaluated {sampled:,} CIDRs in {elapsed_time:.2f} seconds, report written to {report_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("candidate", help="path to the database being tested (.mmdb or a CSV range file)")
+    parser.add_argument("json_files", nargs="+", help="paths to the processed IPv4 and/or IPv6 JSON files")
+    parser.add_argument("--report", default="evaluation.md", help="path to output the markdown report to")
+    parser.add_argument("--samples", type=int, default=4, help="addresses tested per CIDR, including its first and last")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the sampled addresses")
+    args = parser.parse_args()
+
+    evaluate(args.json_files, args.candidate, args.report, args.samples, args.seed)
@@ -0,0 +1,207 @@
+import argparse
+import struct
+import time
+from cidrstore import CidrStore
+
+METADATA_START_MARKER = b"\xab\xcd\xefMaxMind.com"
+
+# MaxMind DB data section type numbers
+TYPE_POINTER = 1
+TYPE_UTF8_STRING = 2
+TYPE_DOUBLE = 3
+TYPE_UINT16 = 5
+TYPE_UINT32 = 6
+TYPE_MAP = 7
+TYPE_UINT64 = 9
+TYPE_ARRAY = 11
+
+
+def to_record(entry):
+    # Lay the properties out like GeoIP2 City records so results can be compared with the commercial databases
+    record = {}
+    if entry.get("country_code"):
+        record["country"] = {"iso_code": entry["country_code"]}
+    if entry.get("subdivision_1_iso_code"):
+        record["subdivisions"] = [{"iso_code": entry["subdivision_1_iso_code"].split("-", 1)[-1]}]
+    if entry.get("city"):
+        record["city"] = {"names": {"en": entry["city"]}}
+    if entry.get("postal_code"):
+        record["postal"] = {"code": entry["postal_code"]}
+    if entry.get("lat") is not None and entry.get("lng") is not None:
+        record["location"] = {"latitude": float(entry["lat"]), "longitude": float(entry["lng"])}
+    return record
+
+
+def encode_control(type_number, size):
+    if size < 29:
+        size_bytes = b""
+    elif size < 285:
+        size_bytes = bytes([size - 29])
+        size = 29
+    elif size < 65821:
+        size_bytes = (size - 285).to_bytes(2, "big")
+        size = 30
+    else:
+        size_bytes = (size - 65821).to_bytes(3, "big")
+        size = 31
+
+    if type_number < 8:
+        return bytes([(type_number << 5) | size]) + size_bytes
+    # Extended types store their number minus 7 in the byte after the control byte
+    return bytes([size, type_number - 7]) + size_bytes
+
+
+def encode_uint(type_number, value):
+    payload = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return encode_control(type_number, len(payload)) + payload
+
+
+def encode(value):
+    if isinstance(value, str):
+        payload = value.encode("utf-8")
+        return encode_control(TYPE_UTF8_STRING, len(payload)) + payload
+    if isinstance(value, float):
+        return encode_control(TYPE_DOUBLE, 8) + struct.pack(">d", value)
+    if isinstance(value, int):
+        return encode_uint(TYPE_UINT64 if value >= 1 << 32 else TYPE_UINT32, value)
+    if isinstance(value, dict):
+        return encode_control(TYPE_MAP, len(value)) + b"".join(
+            encode(key) + encode(item) for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return encode_control(TYPE_ARRAY, len(value)) + b"".join(encode(item) for item in value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a MaxMind DB")
+
+
+class SearchTree:
+    # The binary search tree over IPv6 address bits, IPv4 networks live under ::/96 as MaxMind's own databases do.
+    # Each node is a [left, right] pair whose records are a node index, None when empty, or a ("data", offset) tuple.
+    def __init__(self):
+        self.nodes = [[None, None]]
+
+    def insert(self, network, prefixlen, data):
+        if prefixlen == 0:
+            # ::/0 has no bit to branch on, so the data fills both of the root's records. Supernets are inserted
+            # first, so the root has no subnets yet for it to overwrite.
+            self.nodes[0] = [data, data]
+            return
+
+        node = 0
+        for depth in range(prefixlen):
+            bit = (network >> (127 - depth)) & 1
+            if depth == prefixlen - 1:
+                self.nodes[node][bit] = data
+                return
+
+            record = self.nodes[node][bit]
+            if not isinstance(record, int):
+                # Push an existing supernet's data (or an empty record) down both branches of a new node
+                self.nodes.append([record, record])
+                record = len(self.nodes) - 1
+                self.nodes[node][bit] = record
+            node = record
+
+    def serialize(self, record_size, data_base):
+        node_count = len(self.nodes)
+
+        def value(record):
+            if record is None:
+                return node_count
+            if isinstance(record, int):
+                return record
+            return data_base + record[1]
+
+        output = bytearray()
+        for left, right in self.nodes:
+            left, right = value(left), value(right)
+            if record_size == 24:
+                output += left.to_bytes(3, "big") + right.to_bytes(3, "big")
+            elif record_size == 28:
+                output += (left & 0xFFFFFF).to_bytes(3, "big")
+                output.append(((left >> 24) << 4) | (right >> 24))
+                output += (right & 0xFFFFFF).to_bytes(3, "big")
+            else:
+                output += left.to_bytes(4, "big") + right.to_bytes(4, "big")
+        return bytes(output)
+
+
+def export(ipv4_json_file, ipv6_json_file, mmdb_file):
+    start_time = time.time()
+
+    tree = SearchTree()
+    data_section = bytearray()
+    offsets = {}
+    networks = []
+
+    for json_file in (ipv4_json_file, ipv6_json_file):
+        store = CidrStore.load(json_file)
+        for row, version, start, prefixlen, property_id in store.rows():
+            if version == 4:
+                prefixlen += 96
+            networks.append((prefixlen, start, store.get(row)))
+
+    # Insert supernets before their subnets so a subnet's data overrides the supernet within its range
+    networks.sort(key=lambda network: network[0])
+
+    for prefixlen, start, entry in networks:
+        encoded = encode(to_record(entry))
+        # Identical records share a single copy in the data section
+        if encoded not in offsets:
+            offsets[encoded] = len(data_section)
+            data_section += encoded
+        tree.insert(start, prefixlen, ("data", offsets[encoded]))
+
+    node_count = len(tree.nodes)
+    # Data pointers are node_count + 16 + offset, pick the smallest record size that can hold the largest one
+    largest = node_count + 16 + len(data_section)
+    record_size = next(size for size in (24, 28, 32) if largest < 1 << size)
+
+    metadata = {
+        "node_count": node_count,
+        "record_size": record_size,
+        "ip_version": 6,
+        "database_type": "IP-DB-Test-Data",
+        "languages": ["en"],
+        "binary_format_major_version": 2,
+        "binary_format_minor_version": 0,
+        "build_epoch": int(time.time()),
+        "description": {"en": "IP database testing data built from self-published sources"},
+    }
+
+    with open(mmdb_file, "wb") as file:
+        file.write(tree.serialize(record_size, node_count + 16))
+        file.write(b"\x00" * 16)
+        file.write(data_section)
+        file.write(METADATA_START_MARKER)
+        file.write(encode_metadata(metadata))
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"{len(networks):,} networks written to {mmdb_file} with {node_count:,} nodes and "
+        f"{len(offsets):,} unique records in {elapsed_time:.2f} seconds"
+    )
+
+
+def encode_metadata(metadata):
+    # The format requires specific integer types for these metadata fields
+    uint16_fields = ("record_size", "ip_version", "binary_format_major_version", "binary_format_minor_version")
+    output = encode_control(TYPE_MAP, len(metadata))
+    for key, value in metadata.items():
+        output += encode(key)
+        if key in uint16_fields:
+            output += encode_uint(TYPE_UINT16, value)
+        elif key == "build_epoch":
+            output += encode_uint(TYPE_UINT64, value)
+        else:
+            output += encode(value)
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ipv4_json_file", help="path to the processed IPv4 JSON file")
+    parser.add_argument("ipv6_json_file", help="path to the processed IPv6 JSON file")
+    parser.add_argument("mmdb_file", help="path to output MaxMind DB file")
+    args = parser.parse_args()
+
+    export(args.ipv4_json_file, args.ipv6_json_file, args.mmdb_file)
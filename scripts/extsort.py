@@ -0,0 +1,52 @@
+import heapq
+import os
+import struct
+import tempfile
+
+# Rough size of one record while it's held in a Python list as a tuple of ints, used to turn a memory budget into a
+# number of records per run
+RECORD_OVERHEAD = 200
+
+READ_RECORDS = 4096
+
+
+def spill_runs(records, record_format, memory_budget, temp_dir):
+    # Sort the records in runs that fit in the memory budget and write each run to a file of fixed-width binary
+    # records. Tuples are sorted as they are, so the record's fields must be in sort-key order.
+    record = struct.Struct(record_format)
+    run_size = max(1, memory_budget // (record.size + RECORD_OVERHEAD))
+    runs = []
+    batch = []
+
+    def spill():
+        batch.sort()
+        descriptor, run_file = tempfile.mkstemp(dir=temp_dir, prefix="run-")
+        with os.fdopen(descriptor, "wb") as file:
+            for start in range(0, len(batch), READ_RECORDS):
+                file.write(b"".join(record.pack(*item) for item in batch[start : start + READ_RECORDS]))
+        runs.append(run_file)
+        batch.clear()
+
+    count = 0
+    for item in records:
+        batch.append(item)
+        count += 1
+        if len(batch) >= run_size:
+            spill()
+    if batch:
+        spill()
+    return runs, count
+
+
+def read_run(run_file, record_format):
+    record = struct.Struct(record_format)
+    with open(run_file, "rb") as file:
+        while block := file.read(record.size * READ_RECORDS):
+            yield from record.iter_unpack(block)
+    os.remove(run_file)
+
+
+def merge_runs(runs, record_format):
+    # k-way merge of the sorted runs, each run file is removed once it has been read
+    return heapq.merge(*(read_run(run_file, record_format) for run_file in runs))
+
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# Output filename and URL of every source, the filenames are what build.py looks for in the data directory
+SOURCES = [
+    ("feed.xml", "https://www.pingdom.com/rss/probe_servers.xml"),
+    ("hetrix.txt", "https://hetrixtools.com/resources/uptime-monitor-ips.txt"),
+    ("updown.json", "https://updown.io/api/nodes"),
+    ("statuscake.json", "https://app.statuscake.com/Workfloor/Locations.php?format=json"),
+    ("oracle-ranges.json", "https://docs.oracle.com/en-us/iaas/tools/public_ip_ranges.json"),
+    ("linode-geofeed.csv", "https://geoip.linode.com/"),
+    ("digitalocean-geofeed.csv", "https://digitalocean.com/geo/google.csv"),
+    ("vultr-geofeed.csv", "https://geofeed.constant.com/"),
+    ("starlink-geofeed.csv", "https://geoip.starlinkisp.net/feed.csv"),
+    ("google-geofeed.csv", "https://www.gstatic.com/ipranges/cloud_geofeed"),
+    ("aws-geofeed.csv", "http://ip-ranges.amazonaws.com/geo-ip-feed.csv"),
+    ("ting-geofeed.csv", "https://geoip.tingfiber.net/tf-geofeed.csv"),
+    # ("geolocatemuch-geofeed.csv", "https://geolocatemuch.com/geofeeds/validated-all.csv"),
+]
+
+# ETag and Last-Modified of each downloaded file, kept in the data directory so it's cached along with the files
+STATE_FILE = ".fetch-state.json"
+
+USER_AGENT = "ip-db-test-data (+https://github.com/HostByBelle/ip-db-test-data)"
+CHUNK_SIZE = 1 << 16
+
+
+def load_state(data_dir):
+    try:
+        with open(os.path.join(data_dir, STATE_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(data_dir, state):
+    with open(os.path.join(data_dir, STATE_FILE), "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=0, ensure_ascii=False)
+
+
+def download(url, output_file, previous, timeout):
+    # Blocking conditional GET, returns the new validators or None when the server says the file is unchanged
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    # Validators are only sent for the same URL while its file is still there, otherwise there'd be nothing to keep
+    if previous.get("url") == url and os.path.exists(output_file):
+        if previous.get("etag"):
+            request.add_header("If-None-Match", previous["etag"])
+        if previous.get("last_modified"):
+            request.add_header("If-Modified-Since", previous["last_modified"])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+    # Write next to the destination and rename over it, so an interrupted download never leaves a partial file
+    with response:
+        descriptor, temp_file = tempfile.mkstemp(dir=os.path.dirname(output_file), prefix=".fetch-")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                while chunk := response.read(CHUNK_SIZE):
+                    file.write(chunk)
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, output_file)
+        except BaseException:
+            os.unlink(temp_file)
+            raise
+
+        return {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+
+def retryable(error):
+    # Client errors other than rate limiting won't go away by asking again
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+async def fetch_source(filename, url, data_dir, state, limit, retries, timeout, backoff):
+    output_file = os.path.join(data_dir, filename)
+    async with limit:
+        start_time = time.time()
+        for attempt in range(retries + 1):
+            try:
+                validators = await asyncio.to_thread(download, url, output_file, state.get(filename, {}), timeout)
+                break
+            except Exception as e:
+                if attempt == retries or not retryable(e):
+                    print(f"{filename}: failed after {attempt + 1} attempt(s): {e}")
+                    return False
+                await asyncio.sleep(backoff * 2**attempt)
+
+    elapsed_time = time.time() - start_time
+    if validators is None:
+        print(f"{filename}: not modified ({elapsed_time:.2f} seconds)")
+    else:
+        state[filename] = validators
+        print(f"{filename}: downloaded {os.path.getsize(output_file):,} bytes in {elapsed_time:.2f} seconds")
+    return True
+
+
+async def fetch_all(sources, data_dir, concurrency, retries, timeout, backoff):
+    state = load_state(data_dir)
+    limit = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(
+            fetch_source(filename, url, data_dir, state, limit, retries, timeout, backoff)
+            for filename, url in sources
+        )
+    )
+    save_state(data_dir, state)
+    return results.count(False)
+
+
+def fetch(data_dir, sources=SOURCES, concurrency=6, retries=3, timeout=60, backoff=1.0):
+    os.makedirs(data_dir, exist_ok=True)
+    start_time = time.time()
+    failed = asyncio.run(fetch_all(sources, data_dir, concurrency, retries, timeout, backoff))
+    elapsed_time = time.time() - start_time
+    print(f"Fetched {len(sources) - failed:,} of {len(sources):,} sources in {elapsed_time:.2f} seconds")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_dir", help="directory to download the sources into")
+    parser.add_argument("--sources", help="JSON file of {filename: url} to fetch instead of the built-in sources")
+    parser.add_argument("--concurrency", type=int, default=6, help="maximum number of downloads at once")
+    parser.add_argument("--retries", type=int, default=3, help="retries for each source on network or server errors")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait on a connection before giving up")
+    parser.add_argument("--backoff", type=float, default=1.0, help="seconds before the first retry, doubled each time")
+    args = parser.parse_args()
+
+    sources = SOURCES
+    if args.sources:
+        with open(args.sources, "r", encoding="utf-8") as file:
+            sources = list(json.load(file).items())
+
+    # A failed source keeps its previous copy if there was one, the build carries on without it otherwise
+    fetch(args.data_dir, sources, args.concurrency, args.retries, args.timeout, args.backoff)
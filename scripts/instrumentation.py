@@ -0,0 +1,133 @@
+import argparse
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def peak_rss():
+    # ru_maxrss is the process-wide high-water mark, in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class Metrics:
+    # Per-stage timings, row counts and memory plus named counters for one script run.
+    # Profiling and tracemalloc are opt-in since both slow the run down noticeably.
+    def __init__(self, script, profile_dir=None, trace_memory=False):
+        self.script = script
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.counters = {}
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        # The caller can set "rows" and any other numbers on the yielded record while the stage runs
+        record = {"rows": None}
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        if profiler:
+            profiler.enable()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            if profiler:
+                profiler.disable()
+                suffix = "-".join([name] + [str(value) for value in labels.values()])
+                profiler.dump_stats(self.dump_path(f"{suffix}.prof"))
+            if self.trace_memory:
+                record["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.record(name, elapsed_time, record.pop("rows"), peak_rss(), **labels, **record)
+
+    def record(self, name, seconds, rows=None, peak_rss_bytes=None, **extra):
+        # Stages that were measured elsewhere, such as in a worker process, are recorded directly
+        self.stages.append(
+            {
+                "stage": name,
+                "seconds": seconds,
+                "rows": rows,
+                "rows_per_second": rows / seconds if rows and seconds else None,
+                "peak_rss_bytes": peak_rss_bytes,
+                **extra,
+            }
+        )
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def dump_memory(self, name):
+        if self.trace_memory and self.profile_dir:
+            tracemalloc.take_snapshot().dump(self.dump_path(f"{name}.tracemalloc"))
+
+    def dump_path(self, filename):
+        return os.path.join(self.profile_dir, f"{self.script}-{filename}".replace(" ", "-"))
+
+    def save(self, json_file):
+        with open(json_file, "w", encoding="utf-8") as file:
+            json.dump(
+                {"script": self.script, "stages": self.stages, "counters": self.counters},
+                file,
+                indent=0,
+                ensure_ascii=False,
+            )
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics", help="path to write per-stage timings and counters to as JSON")
+    parser.add_argument("--profile", help="directory to dump cProfile stats (and tracemalloc snapshots) for each stage")
+    parser.add_argument("--trace-memory", action="store_true", help="track per-stage peak memory with tracemalloc")
+
+
+def from_arguments(script, args):
+    return Metrics(script, args.profile, args.trace_memory)
+
+
+def render(metrics_files):
+    lines = []
+    for metrics_file in metrics_files:
+        with open(metrics_file, "r", encoding="utf-8") as file:
+            metrics = json.load(file)
+
+        lines.append(f"\n### {metrics['script']}\n")
+        lines.append("| Stage | Seconds | Rows | Rows/sec | Peak RSS (MiB) |")
+        lines.append("| --- | --- | --- | --- | --- |")
+        for stage in metrics["stages"]:
+            # Anything else on a stage is a label, flags are shown by name
+            labels = [
+                key if isinstance(value, bool) else str(value)
+                for key, value in stage.items()
+                if key not in ("stage", "seconds", "rows", "rows_per_second", "peak_rss_bytes", "peak_traced_bytes")
+                and value is not False
+            ]
+            name = stage["stage"] + (f" ({', '.join(labels)})" if labels else "")
+            rows = f"{stage['rows']:,}" if stage["rows"] is not None else "-"
+            rate = f"{stage['rows_per_second']:,.0f}" if stage["rows_per_second"] else "-"
+            rss = f"{stage['peak_rss_bytes'] / 1048576:,.1f}" if stage["peak_rss_bytes"] else "-"
+            lines.append(f"| {name} | {stage['seconds']:.2f} | {rows} | {rate} | {rss} |")
+
+        if metrics["counters"]:
+            lines.append("")
+            for name, value in metrics["counters"].items():
+                lines.append(f"- {name}: {value:,}")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metrics_files", nargs="+", help="metrics JSON files written by the other scripts")
+    args = parser.parse_args()
+
+    print(render(args.metrics_files))
@@ -0,0 +1,104 @@
+import json
+from json.encoder import encode_basestring
+
+# orjson parses several times faster than the standard library, it's used whenever it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load(json_file):
+    with open(json_file, "rb") as file:
+        if orjson is not None:
+            return orjson.loads(file.read())
+        return json.load(file)
+
+
+def iter_items(json_file, chunk_size=1 << 20):
+    # Yield the (key, value) pairs of a top-level JSON object while reading it in chunks, so a file larger than memory
+    # can be streamed. A value is only accepted once something follows it, so a number cut off at the end of a chunk
+    # is never mistaken for a complete one.
+    decoder = json.JSONDecoder()
+    with open(json_file, "r", encoding="utf-8") as file:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, position, eof
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            return not eof
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n":
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return buffer[position : position + 1]
+
+        def decode():
+            nonlocal position
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    if end < len(buffer) or eof:
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        if skip_whitespace() != "{":
+            raise ValueError(f"{json_file} doesn't hold a JSON object")
+        position += 1
+        if skip_whitespace() == "}":
+            return
+
+        while True:
+            skip_whitespace()
+            key = decode()
+            if skip_whitespace() != ":":
+                raise ValueError(f"Expected ':' in {json_file}")
+            position += 1
+            skip_whitespace()
+            yield key, decode()
+
+            separator = skip_whitespace()
+            position += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' in {json_file}")
+
+
+def encode(value):
+    # Matches json.dump(..., indent=0, ensure_ascii=False), which no faster library can produce
+    return json.dumps(value, indent=0, ensure_ascii=False)
+
+
+def write_items(items, json_file):
+    # Write (string key, value) pairs as one JSON object in the order they're given, without building the dict first.
+    # The data files repeat the same few property records for many CIDRs, so each distinct value object is encoded
+    # once and reused. Returns the number of items written.
+    encoded = {}
+    count = 0
+    with open(json_file, "w", encoding="utf-8") as file:
+        for key, value in items:
+            cached = encoded.get(id(value))
+            if cached is None:
+                # The value is kept alongside its encoding so its id can't be reused by another object
+                cached = encoded[id(value)] = (value, encode(value))
+            file.write(("{\n" if not count else ",\n") + encode_basestring(key) + ": " + cached[1])
+            count += 1
+        file.write("\n}" if count else "{}")
+    return count
+
+
+def dump(data, json_file):
+    return write_items(data.items(), json_file)
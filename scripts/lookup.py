@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+import time
+from itertools import islice
+from rangeindex import RangeIndex, parse_address
+
+
+def source_files(json_files):
+    # The path, size and modification time of each JSON file, an index built from anything else is rebuilt
+    sources = []
+    for json_file in json_files:
+        stat = os.stat(json_file)
+        sources.append([os.path.abspath(json_file), stat.st_size, stat.st_mtime_ns])
+    return sources
+
+
+def load_index(json_files, index_file=None):
+    # Reuse a cached index only if it was built from exactly these JSON files, unchanged since
+    sources = source_files(json_files)
+    if index_file and os.path.exists(index_file):
+        try:
+            if RangeIndex.header(index_file).get("sources") == sources:
+                return RangeIndex.load(index_file)
+        except ValueError:
+            pass
+
+    index = RangeIndex.from_json_files(json_files)
+    if index_file:
+        index.save(index_file, sources)
+    return index
+
+
+def lookup(json_files, input_file, index_file=None, batch_size=100000):
+    start_time = time.time()
+    index = load_index(json_files, index_file)
+    print(f"Loaded {len(index):,} ranges in {time.time() - start_time:.2f} seconds", file=sys.stderr)
+
+    # Each distinct property record is serialised once rather than once per address
+    encoded = {prop: json.dumps(properties, ensure_ascii=False) for prop, properties in enumerate(index.properties)}
+    encoded[None] = "null"
+
+    start_time = time.time()
+    total = 0
+    output = sys.stdout
+
+    with open(input_file, "r", encoding="utf-8") if input_file != "-" else sys.stdin as file:
+        lines = (line.strip() for line in file)
+        addresses = (line for line in lines if line)
+        while True:
+            batch = list(islice(addresses, batch_size))
+            if not batch:
+                break
+
+            queries = []
+            for address in batch:
+                try:
+                    queries.append(parse_address(address))
+                except OSError:
+                    queries.append((0, -1))  # Invalid addresses never match
+
+            results = index.lookup_ids(queries)
+            output.write(
+                "".join(
+                    f'{{"ip": {json.dumps(address)}, "properties": {encoded[prop]}}}\n'
+                    for address, prop in zip(batch, results)
+                )
+            )
+            total += len(batch)
+
+    elapsed_time = time.time() - start_time
+    rate = total / elapsed_time if elapsed_time else 0
+    print(f"Resolved {total:,} addresses in {elapsed_time:.2f} seconds ({rate:,.0f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_files", nargs="+", help="paths to the processed IPv4 and/or IPv6 JSON files")
+    parser.add_argument("--input", default="-", help="file with one IP address per line (defaults to stdin)")
+    parser.add_argument("--index", help="path to cache the range index in, rebuilt when the JSON files change")
+    parser.add_argument("--batch-size", type=int, default=100000, help="addresses resolved per batch")
+    args = parser.parse_args()
+
+    lookup(args.json_files, args.input, args.index, args.batch_size)
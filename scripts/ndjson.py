@@ -0,0 +1,104 @@
+import argparse
+import bisect
+import json
+import time
+from json.encoder import encode_basestring
+import jsoncodec
+from cidrstore import CidrStore, MAX_PREFIXLEN, SHARD_PREFIXLEN, format_network, network_end, parse_network
+from delta import sorted_rows
+
+
+def index_path(ndjson_file):
+    return ndjson_file + ".index.json"
+
+
+def shard_network(version, start):
+    shift = MAX_PREFIXLEN[version] - SHARD_PREFIXLEN[version]
+    return format_network(version, start >> shift << shift, SHARD_PREFIXLEN[version])
+
+
+def export(json_file, ndjson_file):
+    # Write one {"cidr": ..., "properties": ...} record per line sorted by start address, so supernets come before
+    # their subnets. The sidecar index maps each IPv4 /8 and IPv6 /32 to the byte range of the records starting in it,
+    # networks shorter than that are listed separately as they cover more than one shard.
+    start_time = time.time()
+    store = CidrStore.load(json_file)
+    encoded = {}
+    shards = {}
+    spanning = []
+    offset = 0
+
+    with open(ndjson_file, "wb") as file:
+        for row in sorted_rows(store):
+            property_id = store.props[row]
+            if property_id not in encoded:
+                encoded[property_id] = json.dumps(store.properties[property_id], ensure_ascii=False)
+            line = f'{{"cidr": {encode_basestring(store.cidr(row))}, "properties": {encoded[property_id]}}}\n'
+            line = line.encode("utf-8")
+
+            version = store.version[row]
+            if store.prefixlen[row] < SHARD_PREFIXLEN[version]:
+                spanning.append([offset, len(line)])
+            shard = shards.setdefault(shard_network(version, store.start(row)), [offset, 0, 0])
+            shard[1] += len(line)
+            shard[2] += 1
+
+            file.write(line)
+            offset += len(line)
+
+    # Shards are listed in file order as [byte offset, byte length, record count]
+    jsoncodec.dump(
+        {"records": len(store), "shard_prefixlen": SHARD_PREFIXLEN, "shards": shards, "spanning": spanning},
+        index_path(ndjson_file),
+    )
+
+    elapsed_time = time.time() - start_time
+    print(f"{len(store):,} CIDRs written to {ndjson_file} in {len(shards):,} shards in {elapsed_time:.2f} seconds")
+
+
+def read_line(file, offset, length):
+    file.seek(offset)
+    return json.loads(file.read(length))
+
+
+def read_records(ndjson_file, cidr):
+    # Yield every record overlapping a network, in file order, by reading only the shards it covers.
+    # Supernets inside the first shard are found by scanning it from the start, any longer supernets are spanning ones.
+    version, start, prefixlen = parse_network(cidr)
+    end = network_end(version, start, prefixlen)
+    index = jsoncodec.load(index_path(ndjson_file))
+    shard_prefixlen = SHARD_PREFIXLEN[version]
+
+    with open(ndjson_file, "rb") as file:
+        for offset, length in index["spanning"]:
+            record = read_line(file, offset, length)
+            record_version, record_start, record_prefixlen = parse_network(record["cidr"])
+            if record_version == version and record_start < start <= network_end(version, record_start, record_prefixlen):
+                yield record
+
+        shards = [(*parse_network(key)[:2], offset) for key, (offset, _, _) in index["shards"].items()]
+        position = bisect.bisect_left(shards, (version, parse_network(shard_network(version, start))[1]))
+        if position == len(shards) or shards[position][0] != version:
+            return
+
+        file.seek(shards[position][2])
+        for line in file:
+            record = json.loads(line)
+            record_version, record_start, record_prefixlen = parse_network(record["cidr"])
+            if record_version != version or record_start > end:
+                return
+            if network_end(version, record_start, record_prefixlen) < start:
+                continue
+            # Spanning supernets that start before the network were already yielded above
+            if record_prefixlen < shard_prefixlen and record_start < start:
+                continue
+            yield record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_file", help="path to the processed IPv4 or IPv6 JSON file")
+    parser.add_argument("ndjson_file", help="path to output the sorted NDJSON file, the index is written alongside it")
+    args = parser.parse_args()
+
+    export(args.json_file, args.ndjson_file)
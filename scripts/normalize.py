@@ -0,0 +1,59 @@
+import json
+import os
+from functools import lru_cache
+
+# Precomputed from pycountry by running this module, so processing doesn't import pycountry's full database
+TABLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "iso3166.json")
+
+
+@lru_cache(maxsize=None)
+def tables():
+    with open(TABLES_FILE, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    return data["alpha_3"], frozenset(data["alpha_2"]), frozenset(data["subdivisions"])
+
+
+def country_code(code):
+    # 3-letter codes are converted to 2-letter ones, unknown codes are left as they are rather than replaced
+    code = code.strip().upper()
+    if len(code) == 3:
+        return tables()[0].get(code, code)
+    return code
+
+
+def subdivision_code(country, code):
+    # Some sources publish only the part after the country ("CA" rather than "US-CA")
+    code = code.strip().upper()
+    if code and "-" not in code and f"{country}-{code}" in tables()[2]:
+        return f"{country}-{code}"
+    return code
+
+
+def known_country(code):
+    return code in tables()[1]
+
+
+def normalize(entry):
+    # Returns a normalised copy, callers run this once per distinct property record rather than once per CIDR
+    entry = dict(entry)
+    if entry.get("country_code"):
+        entry["country_code"] = country_code(entry["country_code"])
+    if entry.get("subdivision_1_iso_code"):
+        entry["subdivision_1_iso_code"] = subdivision_code(entry.get("country_code", ""), entry["subdivision_1_iso_code"])
+    return entry
+
+
+def generate(tables_file=TABLES_FILE):
+    import pycountry
+
+    data = {
+        "alpha_3": {country.alpha_3: country.alpha_2 for country in pycountry.countries},
+        "alpha_2": sorted(country.alpha_2 for country in pycountry.countries),
+        "subdivisions": sorted(subdivision.code for subdivision in pycountry.subdivisions),
+    }
+    with open(tables_file, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=0, ensure_ascii=False, sort_keys=True)
+
+
+if __name__ == "__main__":
+    generate()
@@ -1,38 +1,17 @@
 import csv
-import json
-import ipaddress
 import argparse
+import os
+from cidrstore import CidrStore, merge_into_files, merge_properties, parse_network
 
+# Rows validated per chunk, large aggregated feeds are streamed rather than read into memory at once
+CHUNK_SIZE = 50000
 
-def merge(existing, new):
-    if existing == new:
-        return existing
-    else:
-        keep = True
-        # Loop through all of the existing values, if they match the new one we can merge them
-        for key, value in existing.items():
-            if new[key] != value:
-                keep = False
 
-        if keep:
-            return existing + new
-        else:
-            print(f"Existing: {existing}. New: {new}")
-            return existing
-
-
-def parse(geofeed_csv, json_file, ipver):
-    data_list = {}
-
-    try:
-        # Load existing data from the JSON file
-        with open(json_file, "r", encoding="utf-8") as existing_file:
-            data_list = json.load(existing_file)
-    except FileNotFoundError:
-        pass  # File doesn't exist yet, ignore and proceed with an empty list
-
-    with open(geofeed_csv, "r") as file:
+def read_chunks(geofeed_csv, chunk_size=CHUNK_SIZE):
+    # Stream the feed in lists of at most chunk_size (line number, row) pairs so memory is bounded by the chunk size
+    with open(geofeed_csv, "r", encoding="utf-8", newline="") as file:
         csv_reader = csv.reader(file)
+        chunk = []
 
         for row in csv_reader:
             # Ensure we skip over any rows which are comments
@@ -41,51 +20,83 @@ def parse(geofeed_csv, json_file, ipver):
                     continue
             except IndexError:
                 continue
-            
-            # Generate a message for an incomplete row
-            if len(row) < 4:
-                print(f"Geofeed file: {geofeed_csv} has rows that are incomplete.")
-                continue
 
-            try: 
-                network = ipaddress.ip_network(row[0], strict=False)
-            except ValueError:
-                continue
+            chunk.append((csv_reader.line_num, row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+def normalize_chunk(chunk, ipver, diagnostics):
+    for line_num, row in chunk:
+        # Count incomplete rows rather than printing a message for every one of them
+        if len(row) < 4:
+            diagnostics.setdefault("incomplete", [0, line_num])[0] += 1
+            continue
+
+        try:
+            network = parse_network(row[0].strip())
+        except ValueError:
+            diagnostics.setdefault("invalid", [0, line_num])[0] += 1
+            continue
+
+        if not (
+            ipver == "both"
+            or (ipver == "ip" and network[0] == 4)
+            or (ipver == "ipv6" and network[0] == 6)
+        ):
+            continue
+
+        properties = {
+            "country_code": row[1].strip().upper(),
+            "subdivision_1_iso_code": row[2].strip().upper(),
+            "city": row[3].strip(),
+        }
+
+        # Ensure we don't create an empty postal code field for these
+        if len(row) > 4 and row[4].strip() != "":
+            properties["postal_code"] = row[4].strip()
+
+        yield network, properties
+
+
+def records(geofeed_csv, ipver="both", chunk_size=CHUNK_SIZE):
+    diagnostics = {}
+
+    for chunk in read_chunks(geofeed_csv, chunk_size):
+        yield from normalize_chunk(chunk, ipver, diagnostics)
+
+    # Generate one message per kind of bad row
+    for kind, (count, first_line) in diagnostics.items():
+        print(f"Geofeed file: {geofeed_csv} has {count:,} rows that are {kind} (first on line {first_line}).")
+
+
+def parse(geofeed_csv, json_file, ipver, ipv6_json_file=None):
+    if ipver == "both":
+        # A single pass over the feed writes both the IPv4 and IPv6 files
+        merge_into_files(
+            records(geofeed_csv), {4: json_file, 6: ipv6_json_file}, merge_properties, os.path.basename(geofeed_csv)
+        )
+        return
+
+    data_list = CidrStore.load(json_file)
+    data_list.update(records(geofeed_csv, ipver), merge_properties, os.path.basename(geofeed_csv))
 
-            if (ipver == "ip" and network.version == 4) or (
-                ipver == "ipv6" and network.version == 6
-            ):
-                
-                # Ensure we don't create an empty postal code field for these
-                if row[4] is not None and row[4] != "":
-                    properties = {
-                        "country_code": row[1],
-                        "subdivision_1_iso_code": row[2],
-                        "city": row[3],
-                        "postal_code": row[4],
-                    }
-                else:
-                    properties = {
-                        "country_code": row[1],
-                        "subdivision_1_iso_code": row[2],
-                        "city": row[3],
-                }
-
-                if row[0] in data_list:
-                    data_list[row[0]] = merge(data_list[row[0]], properties)
-                else:
-                    data_list[row[0]] = properties
-
-        # Write the updated data back to the JSON file
-        with open(json_file, "w", encoding="utf-8") as json_file:
-            json.dump(data_list, json_file, indent=0, ensure_ascii=False)
+    # Write the updated data back to the JSON file
+    data_list.save(json_file)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("geofeed_csv", help="path to the RFC 8805 Geofeed CSV file")
     parser.add_argument("json_file", help="path to output JSON file")
-    parser.add_argument("ipver", help="IP version (ip or ipv6)")
+    parser.add_argument("ipver", help="IP version (ip, ipv6 or both)")
+    parser.add_argument("ipv6_json_file", nargs="?", help="path to output IPv6 JSON file when ipver is both")
     args = parser.parse_args()
+    if args.ipver == "both" and args.ipv6_json_file is None:
+        parser.error("ipv6_json_file is required when ipver is both")
 
-    parse(args.geofeed_csv, args.json_file, args.ipver)
+    parse(args.geofeed_csv, args.json_file, args.ipver, args.ipv6_json_file)
@@ -1,7 +1,7 @@
 import argparse
+import os
 import re
-import json
-import ipaddress
+from cidrstore import CidrStore, host_network, merge_properties
 
 # Each "wk*-" hostname is associated with a location and this mapping was manually built utilizing their documentation
 # See https://docs.hetrixtools.com/uptime-monitoring-ip-addresses/ and https://hetrixtools.com/resources/uptime-monitor-ips.txt
@@ -49,13 +49,6 @@ wk_mapping = {
 }
 
 
-def get_range(address):
-    ip_address = ipaddress.ip_address(address)
-    return str(
-        ipaddress.ip_network(f"{ip_address}/{ip_address.max_prefixlen}", strict=False)
-    )
-
-
 def extract_wk(hostname):
     match = re.match(r"^([a-zA-Z]+[0-9]+).*$", hostname)
     if match:
@@ -64,33 +57,7 @@ def extract_wk(hostname):
         return None
 
 
-def merge(existing, new):
-    if existing == new:
-        return existing
-    else:
-        keep = True
-        # Loop through all of the existing values, if they match the new one we can merge them
-        for key, value in existing.items():
-            if new[key] != value:
-                keep = False
-
-        if keep:
-            return existing + new
-        else:
-            print(f"Existing: {existing}. New: {new}")
-            return existing
-
-
-def parse(file_path, json_file):
-    data_list = {}
-
-    try:
-        # Load existing data from the JSON file
-        with open(json_file, "r", encoding="utf-8") as existing_file:
-            data_list = json.load(existing_file)
-    except FileNotFoundError:
-        pass  # File doesn't exist yet, ignore and proceed with an empty list
-
+def records(file_path):
     with open(file_path, "r") as file:
         for line in file:
             match = re.match(r"^(\S+)\s+(\S+)", line)
@@ -101,17 +68,17 @@ def parse(file_path, json_file):
 
                 if hostname and ip_address and wk:
                     if wk in wk_mapping:
-                        CIDR = get_range(ip_address)
-                        if CIDR in data_list:
-                            data_list[CIDR] = merge(data_list[CIDR], wk_mapping[wk])
-                        else:
-                            data_list[CIDR] = wk_mapping[wk]
+                        yield host_network(ip_address), wk_mapping[wk]
                     else:
                         print(f"(Hetrix) {wk} is not yet mapped")
 
-        # Write the updated data back to the JSON file
-        with open(json_file, "w", encoding="utf-8") as json_file:
-            json.dump(data_list, json_file, indent=0, ensure_ascii=False)
+
+def parse(file_path, json_file):
+    data_list = CidrStore.load(json_file)
+    data_list.update(records(file_path), merge_properties, os.path.basename(file_path))
+
+    # Write the updated data back to the JSON file
+    data_list.save(json_file)
 
 
 if __name__ == "__main__":
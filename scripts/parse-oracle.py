@@ -1,5 +1,7 @@
 import argparse
 import json
+import os
+from cidrstore import CidrStore, merge_properties, parse_network
 
 # Manually gathered from https://docs.oracle.com/en-us/iaas/Content/General/Concepts/regions.htm
 region_info = {
@@ -134,51 +136,24 @@ region_info = {
 }
 
 
-def merge(existing, new):
-    if existing == new:
-        return existing
-    else:
-        keep = True
-        # Loop through all of the existing values, if they match the new one we can merge them
-        for key, value in existing.items():
-            if new[key] != value:
-                keep = False
-
-        if keep:
-            return existing + new
-        else:
-            print(f"Existing: {existing}. New: {new}")
-            return existing
-
-
-def parse(updown_data, json_file):
-    data_list = {}
-
-    try:
-        # Load existing data from the JSON file
-        with open(json_file, "r", encoding="utf-8") as existing_file:
-            data_list = json.load(existing_file)
-    except FileNotFoundError:
-        pass  # File doesn't exist yet, ignore and proceed with an empty list
-
+def records(updown_data):
     with open(updown_data, "r") as file:
         oracle_ips = json.load(file)
         for region in oracle_ips["regions"]:
             if region["region"] in region_info:
                 for cidr in region["cidrs"]:
-                    if cidr["cidr"] in data_list:
-                        data_list[cidr["cidr"]] = merge(
-                            data_list[cidr["cidr"]], region_info[region["region"]]
-                        )
-                    else:
-                        data_list[cidr["cidr"]] = region_info[region["region"]]
+                    yield parse_network(cidr["cidr"]), region_info[region["region"]]
             else:
                 region = region["region"]
                 print(f"(Oracle) {region} is not yet mapped")
 
-        # Write the updated data back to the JSON file
-        with open(json_file, "w", encoding="utf-8") as json_file:
-            json.dump(data_list, json_file, indent=0, ensure_ascii=False)
+
+def parse(updown_data, json_file):
+    data_list = CidrStore.load(json_file)
+    data_list.update(records(updown_data), merge_properties, os.path.basename(updown_data))
+
+    # Write the updated data back to the JSON file
+    data_list.save(json_file)
 
 
 if __name__ == "__main__":
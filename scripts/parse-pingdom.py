@@ -1,57 +1,32 @@
 import argparse
-import json
+import os
 import xml.etree.ElementTree as ET
-import ipaddress
+from cidrstore import CidrStore, host_network, merge_into_files, merge_properties
 
 PINGDOM_NAMESPACE = "http://www.pingdom.com/ns/PingdomRSSNamespace"
 
 
-def get_range(address):
-    ip_address = ipaddress.ip_address(address)
-    return str(
-        ipaddress.ip_network(f"{ip_address}/{ip_address.max_prefixlen}", strict=False)
-    )
-
-
-def merge(existing, new):
-    if existing == new:
-        return existing
-    else:
-        keep = True
-        # Loop through all of the existing values, if they match the new one we can merge them
-        for key, value in existing.items():
-            if new[key] != value:
-                keep = False
-
-        if keep:
-            return existing + new
-        else:
-            print(f"Existing: {existing}. New: {new}")
-            return existing
-
-
-def parse_xml(xml_file, ip_type, json_file):
+def records(xml_file, ip_type="both"):
     tree = ET.parse(xml_file, parser=ET.XMLParser(encoding="utf-8"))
     root = tree.getroot()
 
-    data_list = {}
-
-    try:
-        # Load existing data from the JSON file
-        with open(json_file, "r", encoding="utf-8") as existing_file:
-            data_list = json.load(existing_file)
-    except FileNotFoundError:
-        pass  # File doesn't exist yet, ignore and proceed with an empty list
+    ip_types = ["ip", "ipv6"] if ip_type == "both" else [ip_type]
 
     for item in root.iterfind(".//item"):
-        ip_address_element = item.find(
-            f"pingdom:{ip_type}", {"pingdom": PINGDOM_NAMESPACE}
-        )
-        if ip_address_element is None:
-            continue
-        ip_address = ip_address_element.text
-
-        if ip_address is None or ip_address == "NULL":
+        ip_addresses = []
+        for address_type in ip_types:
+            ip_address_element = item.find(
+                f"pingdom:{address_type}", {"pingdom": PINGDOM_NAMESPACE}
+            )
+            if ip_address_element is None:
+                continue
+            ip_address = ip_address_element.text
+
+            if ip_address is None or ip_address == "NULL":
+                continue
+            ip_addresses.append(ip_address)
+
+        if not ip_addresses:
             continue
 
         country_element = item.find("pingdom:country", {"pingdom": PINGDOM_NAMESPACE})
@@ -59,29 +34,40 @@ def parse_xml(xml_file, ip_type, json_file):
 
         city = item.find("pingdom:city", {"pingdom": PINGDOM_NAMESPACE}).text
 
-        cidr = get_range(ip_address)
         properties = {
             "country_code": country_code,
             "city": city,
         }
-        if cidr in data_list:
-            data_list[cidr] = merge(data_list[cidr], properties)
-        else:
-            data_list[cidr] = properties
+        for ip_address in ip_addresses:
+            yield host_network(ip_address), properties
+
+
+def parse_xml(xml_file, ip_type, json_file, ipv6_json_file=None):
+    if ip_type == "both":
+        # A single pass over the feed writes both the IPv4 and IPv6 files
+        merge_into_files(
+            records(xml_file), {4: json_file, 6: ipv6_json_file}, merge_properties, os.path.basename(xml_file)
+        )
+        return
+
+    data_list = CidrStore.load(json_file)
+    data_list.update(records(xml_file, ip_type), merge_properties, os.path.basename(xml_file))
 
     # Write the updated data back to the JSON file
-    with open(json_file, "w", encoding="utf-8") as json_file:
-        json.dump(data_list, json_file, indent=0, ensure_ascii=False)
+    data_list.save(json_file)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("xml_file", help="path to XML file")
     parser.add_argument("json_file", help="path to output JSON file")
-    parser.add_argument("ip_type", help="type of IP address")
+    parser.add_argument("ip_type", help="type of IP address (ip, ipv6 or both)")
+    parser.add_argument("ipv6_json_file", nargs="?", help="path to output IPv6 JSON file when the type is both")
     args = parser.parse_args()
+    if args.ip_type == "both" and args.ipv6_json_file is None:
+        parser.error("ipv6_json_file is required when ip_type is both")
 
-    parse_xml(args.xml_file, args.ip_type, args.json_file)
+    parse_xml(args.xml_file, args.ip_type, args.json_file, args.ipv6_json_file)
 
 
 if __name__ == "__main__":
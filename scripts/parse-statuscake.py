@@ -1,65 +1,46 @@
 import argparse
 import json
-import ipaddress
+import os
+from cidrstore import CidrStore, host_network, merge_into_files, merge_properties
 
 
-def get_range(address):
-    ip_address = ipaddress.ip_address(address)
-    return str(
-        ipaddress.ip_network(f"{ip_address}/{ip_address.max_prefixlen}", strict=False)
-    )
-
-
-def merge(existing, new):
-    if existing == new:
-        return existing
-    else:
-        keep = True
-        # Loop through all of the existing values, if they match the new one we can merge them
-        for key, value in existing.items():
-            if new[key] != value:
-                keep = False
-
-        if keep:
-            return existing + new
-        else:
-            print(f"Existing: {existing}. New: {new}")
-            return existing
-
-
-def parse(updown_data, json_file, ipver):
-    data_list = {}
-
-    try:
-        # Load existing data from the JSON file
-        with open(json_file, "r", encoding="utf-8") as existing_file:
-            data_list = json.load(existing_file)
-    except FileNotFoundError:
-        pass  # File doesn't exist yet, ignore and proceed with an empty list
+def records(updown_data, ipver="both"):
+    ipvers = ["ip", "ipv6"] if ipver == "both" else [ipver]
 
     with open(updown_data, "r") as file:
         statuscake_nodes = json.load(file)
         for node in statuscake_nodes:
-            if not statuscake_nodes[node][ipver]:
-                continue
-
-            cidr = get_range(statuscake_nodes[node][ipver])
             properties = {"country_code": statuscake_nodes[node]["countryiso"]}
-            if cidr in data_list:
-                data_list[cidr] = merge(data_list[cidr], properties)
-            else:
-                data_list[cidr] = properties
+            for ipver in ipvers:
+                if not statuscake_nodes[node][ipver]:
+                    continue
+
+                yield host_network(statuscake_nodes[node][ipver]), properties
+
+
+def parse(updown_data, json_file, ipver, ipv6_json_file=None):
+    if ipver == "both":
+        # A single pass over the file writes both the IPv4 and IPv6 files
+        merge_into_files(
+            records(updown_data), {4: json_file, 6: ipv6_json_file}, merge_properties, os.path.basename(updown_data)
+        )
+        return
+
+    data_list = CidrStore.load(json_file)
+    data_list.update(records(updown_data, ipver), merge_properties, os.path.basename(updown_data))
 
-        # Write the updated data back to the JSON file
-        with open(json_file, "w", encoding="utf-8") as json_file:
-            json.dump(data_list, json_file, indent=0, ensure_ascii=False)
+    # Write the updated data back to the JSON file
+    data_list.save(json_file)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("updown_data", help="path to the statuscake JSON file")
     parser.add_argument("json_file", help="path to output JSON file")
-    parser.add_argument("ipver", help="IP version (ip or ipv6)")
+    parser.add_argument("ipver", help="IP version (ip, ipv6 or both)")
+    parser.add_argument("ipv6_json_file", nargs="?", help="path to output IPv6 JSON file when ipver is both")
     args = parser.parse_args()
+    if args.ipver == "both" and args.ipv6_json_file is None:
+        parser.error("ipv6_json_file is required when ipver is both")
 
-    parse(args.updown_data, args.json_file, args.ipver)
+    parse(args.updown_data, args.json_file, args.ipver, args.ipv6_json_file)
@@ -1,104 +1,448 @@
 import argparse
-import json
+import bisect
 import ipaddress
-import pycountry
+import itertools
+import os
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor
+import extsort
+import instrumentation
+import jsoncodec
+import normalize
+from cidrstore import (
+    CidrStore,
+    LOW_BITS,
+    MAX_PREFIXLEN,
+    SHARD_PREFIXLEN,
+    format_network,
+    network_end,
+    parse_network,
+    range_networks,
+)
+from instrumentation import Metrics
+from rangeindex import flatten, sweep
 
-# Some global stats
-totalIPs = 0
-overlappedCIDRs = 0
-ignoredPrivateCIDRs = 0
+# Fixed-width records for the out-of-core mode. Fields are in sort order: by address to resolve overlaps, then
+# (prefix length, input position) to write the kept networks back out in the same order as the in-memory mode.
+NETWORK_RECORD = "<BQQBQI"  # version, start (high and low 64 bits), prefix length, input position, property id
+KEPT_RECORD = "<BQBQQI"  # prefix length, input position, version, start (high and low 64 bits), property id
 
 
-def convert_to_2_letter_code(three_letter_code):
-    try:
-        country = pycountry.countries.get(alpha_3=three_letter_code)
-        if country:
-            return country.alpha_2
-        else:
-            return "Not found"
-    except Exception as e:
-        print(f"Error: {e}")
+class PrefixTrie:
+    # A binary prefix trie flattened into one hash table per prefix length.
+    # Walking the prefix lengths that are actually in use answers "nearest covering supernet" in O(prefixlen)
+    # without ever rebuilding ipaddress objects for the networks already kept.
+    def __init__(self, max_prefixlen):
+        self.max_prefixlen = max_prefixlen
+        self.address = ipaddress.IPv4Address if max_prefixlen == 32 else ipaddress.IPv6Address
+        self.levels = {}
+        # Prefix lengths in use, kept sorted so lookups only visit levels that hold networks
+        self.lengths = []
+
+    def mask(self, prefixlen):
+        return ((1 << prefixlen) - 1) << (self.max_prefixlen - prefixlen)
+
+    def nearest_supernet(self, network, prefixlen):
+        for level in reversed(self.lengths[: bisect.bisect_right(self.lengths, prefixlen)]):
+            key = network & self.mask(level)
+            if key in self.levels[level]:
+                return level, key, self.levels[level][key]
         return None
 
+    def kept_subnet(self, network, prefixlen):
+        # CIDRs are either nested or disjoint, so the only way to overlap a kept network without being its subnet is
+        # to contain it. Input sorted by descending size never has longer prefixes kept, so this returns immediately.
+        upper = network | ((1 << (self.max_prefixlen - prefixlen)) - 1)
+        for level in self.lengths[bisect.bisect_right(self.lengths, prefixlen) :]:
+            for kept in self.levels[level]:
+                if network <= kept <= upper:
+                    return f"{self.address(kept)}/{level}"
+        return None
 
-def process(json_file):
-    global totalIPs, overlappedCIDRs, ignoredPrivateCIDRs
+    def insert(self, network, prefixlen, entry):
+        if prefixlen not in self.levels:
+            bisect.insort(self.lengths, prefixlen)
+            self.levels[prefixlen] = {}
+        self.levels[prefixlen][network] = entry
 
-    # Record the start time and memory usage before processing
-    start_time = time.time()
 
-    with open(json_file, "r", encoding="utf-8") as file:
-        ip_data_list = json.load(file)
-        result = {}
+def resolve_shard(version, rows, seeds):
+    # Resolve one shard of (row, start, prefixlen, property id) tuples, sorted by ascending prefix length.
+    # seeds are the kept networks shorter than the shard prefix that cover it, they act as supernets but aren't returned.
+    trie = PrefixTrie(MAX_PREFIXLEN[version])
+    for network, prefixlen, entry in seeds:
+        trie.insert(network, prefixlen, entry)
 
-        ip_data_list = dict(
-            sorted(
-                ip_data_list.items(),
-                key=lambda item: ipaddress.ip_network(item[0]).num_addresses,
-                reverse=True,
-            )
-        )
+    kept = []
+    messages = []
+    total_ips = 0
+    overlapped = 0
+    ignored_private = 0
 
-        for cidr, entry in ip_data_list.items():
-            if not entry:
+    for row, network, prefixlen, entry in rows:
+        end = network | ((1 << (trie.max_prefixlen - prefixlen)) - 1)
+        if trie.address(network).is_private and trie.address(end).is_private:
+            ignored_private += 1
+            continue
+
+        # Handle overlaps / subnets
+        supernet = trie.nearest_supernet(network, prefixlen)
+        if supernet is not None:
+            # If a subnet has the same info as its nearest supernet, remove it entirely.
+            # Otherwise a subnet can have separate info from its larger network and as such should be handled as correct
+            if entry == supernet[2]:
                 continue
+        else:
+            subnet = trie.kept_subnet(network, prefixlen)
+            if subnet is not None:
+                # Record a warning and discard the overlapping network
+                overlapped += 1
+                messages.append(f"{trie.address(network)}/{prefixlen} was discarded for overlapping with {subnet}")
+                continue
+
+        kept.append((row, network, prefixlen, entry))
+        trie.insert(network, prefixlen, entry)
+        if supernet is None:
+            total_ips += 1 << (trie.max_prefixlen - prefixlen)
+
+    return kept, total_ips, overlapped, ignored_private, messages
+
 
-            # Convert IP range to ipaddress object
-            ip_network = ipaddress.ip_network(cidr, strict=False)
+def aggregate(version, kept):
+    # Collapse sibling networks with the same property id into their parent, one sorted pass per prefix length from the
+    # longest up so that merged parents can merge again. Only exact siblings are merged, so nested subnets and the
+    # networks that sit between them are never absorbed and every address still resolves to the same record.
+    max_prefixlen = MAX_PREFIXLEN[version]
+    trie = PrefixTrie(max_prefixlen)
+    rows = {}
+    for row, network, prefixlen, entry in kept:
+        trie.insert(network, prefixlen, entry)
+        rows[network, prefixlen] = row
 
-            if ip_network.is_private:
-                ignoredPrivateCIDRs += 1
+    for prefixlen in range(max_prefixlen, 0, -1):
+        level = trie.levels.get(prefixlen)
+        if not level:
+            continue
+
+        size = 1 << (max_prefixlen - prefixlen)
+        for network in sorted(level):
+            sibling = network | size
+            if network & size or network not in level or sibling not in level or level[network] != level[sibling]:
                 continue
 
-            # Check IP ranges for overlaps
-            if len(entry["country_code"]) == 3:
-                entry["country_code"] = convert_to_2_letter_code(entry["country_code"])
-
-            # Handle overlaps / subnets
-            keep_network = True
-            was_in_subnet = False
-
-            for kept_cidr, kept_entry in result.items():
-                existing_range = ipaddress.ip_network(kept_cidr, strict=False)
-                if ip_network.subnet_of(existing_range):
-                    # If a subnet has the same info as the supernet, remove it entirely.
-                    if entry == kept_entry:
-                        keep_network = False
-                    else:
-                        # A subnet can have separate info from its larger network and as such should be handled as correct
-                        keep_network = True
-                        was_in_subnet = True
-                elif ip_network.overlaps(existing_range):
-                    # Print a warning and discard the overlapping network
-                    keep_network = False
-                    overlappedCIDRs += 1
-                    print(
-                        f"{ip_network} was discarded for overlapping with {existing_range}"
-                    )
-
-            if keep_network:
-                result[cidr] = entry
-                if not was_in_subnet:
-                    totalIPs += ip_network.num_addresses
+            entry = level.pop(network)
+            del level[sibling]
+            row = min(rows.pop((network, prefixlen)), rows.pop((sibling, prefixlen)))
+
+            # An existing parent is completely covered by the two subnets, so it takes their data and keeps its place
+            parent_prefixlen = prefixlen - 1
+            if network in trie.levels.get(parent_prefixlen, ()):
+                row = rows.pop((network, parent_prefixlen))
+                del trie.levels[parent_prefixlen][network]
+
+            # A parent with the same info as its nearest supernet is removed entirely, as during overlap resolution
+            supernet = trie.nearest_supernet(network, parent_prefixlen - 1)
+            if supernet is not None and supernet[2] == entry:
+                continue
+
+            trie.insert(network, parent_prefixlen, entry)
+            rows[network, parent_prefixlen] = row
+
+    return [(row, network, prefixlen, trie.levels[prefixlen][network]) for (network, prefixlen), row in rows.items()]
+
+
+def count_split(networks):
+    # A network is split when flattening if it has any subnet, and in (start, -end) order its first subnet comes
+    # straight after it
+    networks = sorted(networks, key=lambda network: (network[0], -network[1]))
+    return sum(1 for network, following in zip(networks, networks[1:]) if following[0] <= network[1])
+
+
+def flatten_networks(version, kept, metrics):
+    # Sweep the nested networks into sorted, non-overlapping ranges where the most specific network wins, then write
+    # each range back out as the fewest CIDRs that cover it
+    networks = [(network, network_end(version, network, prefixlen), entry) for _, network, prefixlen, entry in kept]
+    metrics.count("split_cidrs", count_split(networks))
+    return [
+        (version, network, prefixlen, entry)
+        for start, end, entry in flatten(networks)
+        for network, prefixlen in range_networks(version, start, end)
+    ]
+
+
+def resolve(store, workers=None, metrics=None, aggregated=False, flattened=False):
+    if metrics is None:
+        metrics = Metrics("process")
+
+    # Country and subdivision codes are normalised once per distinct property record rather than once per CIDR.
+    # Records that become identical share an id afterwards, so shards only need to compare ids.
+    store.map_properties(normalize.normalize)
+    unknown = {
+        property_id
+        for property_id, entry in enumerate(store.properties)
+        if entry.get("country_code") and not normalize.known_country(entry["country_code"])
+    }
+
+    # Sort in descending order by the quantity of IP addresses, which is ascending by prefix length
+    order = sorted(range(len(store)), key=store.prefixlen.__getitem__)
+
+    # Networks shorter than the shard prefix span several shards and are resolved up front
+    spanning = {4: [], 6: []}
+    shards = {}
+    for row in order:
+        if not store.get(row):
+            continue
+
+        version = store.version[row]
+        record = (row, store.start(row), store.prefixlen[row], store.props[row])
+        if record[3] in unknown:
+            metrics.count("unknown_country_codes")
+        if record[2] < SHARD_PREFIXLEN[version]:
+            spanning[version].append(record)
+        else:
+            key = (version, record[1] >> (MAX_PREFIXLEN[version] - SHARD_PREFIXLEN[version]))
+            shards.setdefault(key, []).append(record)
+
+    results = [resolve_shard(version, rows, []) for version, rows in spanning.items()]
+    kept_spanning = {version: result[0] for version, result in zip(spanning, results)}
+
+    # Shards only ever consult their nearest kept supernet, so each is seeded with the deepest spanning network that
+    # covers it, found in a trie of the spanning networks rather than by scanning all of them for every shard
+    spanning_tries = {}
+    for version, version_kept in kept_spanning.items():
+        spanning_tries[version] = PrefixTrie(MAX_PREFIXLEN[version])
+        for _, network, prefixlen, entry in version_kept:
+            spanning_tries[version].insert(network, prefixlen, entry)
+
+    jobs = []
+    for (version, shard), rows in shards.items():
+        shift = MAX_PREFIXLEN[version] - SHARD_PREFIXLEN[version]
+        supernet = spanning_tries[version].nearest_supernet(shard << shift, SHARD_PREFIXLEN[version])
+        seeds = [] if supernet is None else [(supernet[1], supernet[0], supernet[2])]
+        jobs.append((version, rows, seeds))
+
+    if workers == 1 or len(jobs) < 2:
+        results.extend(resolve_shard(*job) for job in jobs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results.extend(executor.map(resolve_shard, *zip(*jobs), chunksize=max(1, len(jobs) // 64)))
+
+    metrics.count("shards", len(jobs))
+    kept = []
+    for shard_kept, total_ips, overlapped, ignored_private, messages in results:
+        kept.extend(shard_kept)
+        metrics.count("total_ips", total_ips)
+        metrics.count("overlapping_cidrs", overlapped)
+        metrics.count("private_cidrs", ignored_private)
+        for message in messages:
+            print(message)
+
+    by_version = {4: [], 6: []}
+    for record in kept:
+        by_version[store.version[record[0]]].append(record)
+
+    if aggregated:
+        by_version = {version: aggregate(version, records) for version, records in by_version.items()}
+        metrics.count("aggregated_cidrs", len(kept) - sum(len(records) for records in by_version.values()))
+        kept = by_version[4] + by_version[6]
+
+    if flattened:
+        records = [
+            record
+            for version, version_records in by_version.items()
+            for record in flatten_networks(version, version_records, metrics)
+        ]
+    else:
+        # Concatenated shard results are put back into the global processing order, so the output doesn't depend on
+        # sharding
+        kept.sort(key=lambda record: (record[2], record[0]))
+        records = [(store.version[row], network, prefixlen, entry) for row, network, prefixlen, entry in kept]
+
+    # CIDRs are formatted as they're written, so the result never has to exist as one big dict
+    return (
+        (format_network(version, network, prefixlen), store.properties[entry])
+        for version, network, prefixlen, entry in records
+    )
+
+
+def read_records(json_file, properties):
+    # Stream the JSON file into network records, each distinct property record is normalised and interned once
+    property_ids = {}
+    normalized = {}
+    for position, (cidr, entry) in enumerate(jsoncodec.iter_items(json_file)):
+        raw = tuple(entry.items())
+        property_id = normalized.get(raw)
+        if property_id is None:
+            entry = normalize.normalize(entry)
+            property_id = property_ids.setdefault(tuple(entry.items()), len(properties))
+            if property_id == len(properties):
+                properties.append(entry)
+            normalized[raw] = property_id
+
+        version, start, prefixlen = parse_network(cidr)
+        yield version, start >> 64, start & LOW_BITS, prefixlen, position, property_id
+
+
+def resolve_stream(records, properties, metrics):
+    # The same rules as resolve_shard() over records sorted by address. In that order a network's supernets all come
+    # before it, so a stack of the kept networks still open holds its nearest kept supernet on top.
+    unknown = {
+        property_id
+        for property_id, entry in enumerate(properties)
+        if entry.get("country_code") and not normalize.known_country(entry["country_code"])
+    }
+    stack = []
+    previous = None
+    for version, start_hi, start_lo, prefixlen, position, property_id in records:
+        # Differently written copies of a CIDR sort together, the first one in the file wins
+        if (version, start_hi, start_lo, prefixlen) == previous:
+            continue
+        previous = (version, start_hi, start_lo, prefixlen)
+        if not properties[property_id]:
+            continue
+        if property_id in unknown:
+            metrics.count("unknown_country_codes")
+
+        start = (start_hi << 64) | start_lo
+        end = network_end(version, start, prefixlen)
+        address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        if address(start).is_private and address(end).is_private:
+            metrics.count("private_cidrs")
+            continue
+
+        while stack and (stack[-1][0] != version or stack[-1][1] < start):
+            stack.pop()
+        # If a subnet has the same info as its nearest supernet, remove it entirely
+        if stack and stack[-1][2] == property_id:
+            continue
+        if not stack:
+            metrics.count("total_ips", end - start + 1)
+
+        stack.append((version, end, property_id))
+        yield version, start, prefixlen, position, property_id
+
+
+def count_split_stream(networks, metrics):
+    # The streaming form of count_split(), a network is split if the next one starts inside it
+    previous = None
+    for network in networks:
+        if previous is not None and network[0] <= previous[1]:
+            metrics.count("split_cidrs")
+        previous = network
+        yield network
+
+
+def flatten_stream(kept, metrics):
+    # Kept networks arrive sorted by address, which is the order the sweep needs, so nothing is held in memory but
+    # the open supernets
+    for version, records in itertools.groupby(kept, key=lambda record: record[0]):
+        networks = ((start, network_end(version, start, prefixlen), entry) for _, start, prefixlen, _, entry in records)
+        for start, end, entry in sweep(count_split_stream(networks, metrics)):
+            for network, prefixlen in range_networks(version, start, end):
+                yield version, network, prefixlen, entry
+
+
+def process_external(json_file, memory_budget, temp_dir, metrics, flattened=False):
+    # Out-of-core processing: the file is streamed into sorted runs of fixed-width records on disk and k-way merged,
+    # so memory use is bounded by the budget and the number of distinct property records rather than the CIDR count
+    properties = []
+    with tempfile.TemporaryDirectory(dir=temp_dir) as run_dir:
+        with metrics.stage("load") as stage:
+            records = read_records(json_file, properties)
+            runs, stage["rows"] = extsort.spill_runs(records, NETWORK_RECORD, memory_budget, run_dir)
+
+        kept = resolve_stream(extsort.merge_runs(runs, NETWORK_RECORD), properties, metrics)
+        if flattened:
+            # Resolution and the sweep run as the output is written
+            records = flatten_stream(kept, metrics)
+        else:
+            with metrics.stage("resolve") as stage:
+                kept = (
+                    (prefixlen, position, version, start >> 64, start & LOW_BITS, entry)
+                    for version, start, prefixlen, position, entry in kept
+                )
+                runs, stage["rows"] = extsort.spill_runs(kept, KEPT_RECORD, memory_budget, run_dir)
+            records = (
+                (version, (start_hi << 64) | start_lo, prefixlen, entry)
+                for prefixlen, _, version, start_hi, start_lo, entry in extsort.merge_runs(runs, KEPT_RECORD)
+            )
+
+        with metrics.stage("write") as stage:
+            items = (
+                (format_network(version, network, prefixlen), properties[entry])
+                for version, network, prefixlen, entry in records
+            )
+            stage["rows"] = jsoncodec.write_items(items, json_file)
+
+
+def process(
+    json_file, workers=None, metrics=None, aggregated=False, flattened=False, memory_budget=None, temp_dir=None
+):
+    if metrics is None:
+        metrics = Metrics(f"process {os.path.basename(json_file)}")
+
+    start_time = time.time()
+
+    if memory_budget is not None:
+        process_external(json_file, memory_budget, temp_dir, metrics, flattened)
+    else:
+        # Each CIDR is parsed exactly once while loading
+        with metrics.stage("load") as stage:
+            store = CidrStore.load(json_file)
+            stage["rows"] = len(store)
+
+        with metrics.stage("resolve") as stage:
+            result = resolve(store, workers, metrics, aggregated, flattened)
+            stage["rows"] = len(store)
+        metrics.dump_memory("resolve")
 
         # Write the updated data back to the JSON file
-        with open(json_file, "w", encoding="utf-8") as json_file:
-            json.dump(result, json_file, indent=0, ensure_ascii=False)
+        with metrics.stage("write") as stage:
+            stage["rows"] = jsoncodec.write_items(result, json_file)
 
-        # Calculate the time taken and memory used
-        elapsed_time = time.time() - start_time
+    elapsed_time = time.time() - start_time
 
-        print(f"{totalIPs:,} IPs in the final data source.")
+    print(f"{metrics.counters.get('total_ips', 0):,} IPs in the final data source.")
+    if flattened:
+        print(
+            f"There were {metrics.counters.get('split_cidrs', 0):,} CIDRs split around their subnets and "
+            f"{metrics.counters.get('private_cidrs', 0):,} private CIDRs that were discarded."
+        )
+    else:
         print(
-            f"There were {overlappedCIDRs:,} overlapping and {ignoredPrivateCIDRs:,} private CIDRs that were discarded."
+            f"There were {metrics.counters.get('overlapping_cidrs', 0):,} overlapping and "
+            f"{metrics.counters.get('private_cidrs', 0):,} private CIDRs that were discarded."
         )
-        print(f"Time taken: {elapsed_time:.2f} seconds")
+    if "aggregated_cidrs" in metrics.counters:
+        print(f"{metrics.counters['aggregated_cidrs']:,} CIDRs were removed by aggregating adjacent networks.")
+    print(f"Time taken: {elapsed_time:.2f} seconds")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("json_file", help="path to output JSON file")
+    parser.add_argument("--workers", type=int, help="number of processes resolving shards (defaults to the CPU count)")
+    parser.add_argument(
+        "--aggregate", action="store_true", help="merge adjacent networks with identical data into larger CIDRs"
+    )
+    parser.add_argument(
+        "--flatten", action="store_true", help="split supernets around their subnets so no CIDRs in the output overlap"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="process out of core in sorted runs of about this many MiB, use --flatten rather than --aggregate with it",
+    )
+    parser.add_argument("--temp-dir", help="directory for the sorted runs (defaults to the system temp directory)")
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    if args.memory_budget is not None and args.aggregate:
+        # --flatten already writes the fewest CIDRs for every range, which is what aggregation would get to
+        parser.error("--aggregate isn't supported out of core, use --flatten")
 
-    process(args.json_file)
+    metrics = instrumentation.from_arguments(f"process {os.path.basename(args.json_file)}", args)
+    memory_budget = args.memory_budget * 1048576 if args.memory_budget is not None else None
+    process(args.json_file, args.workers, metrics, args.aggregate, args.flatten, memory_budget, args.temp_dir)
+    if args.metrics:
+        metrics.save(args.metrics)
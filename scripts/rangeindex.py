@@ -0,0 +1,267 @@
+import bisect
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from cidrstore import CidrStore, LOW_BITS, network_end
+
+INDEX_MAGIC = b"IPRIDX01"
+
+# Column layout of an index file, after the magic and header length:
+# a JSON header, then the IPv4 start/end/property columns, the IPv6 columns split into 64-bit halves,
+# and finally the property records as JSON. Every column is little-endian and 8-byte aligned so it can be memory-mapped.
+IPV4_COLUMNS = [("v4_start", "I"), ("v4_end", "I"), ("v4_props", "I")]
+IPV6_COLUMNS = [
+    ("v6_start_hi", "Q"),
+    ("v6_start_lo", "Q"),
+    ("v6_end_hi", "Q"),
+    ("v6_end_lo", "Q"),
+    ("v6_props", "I"),
+]
+
+
+def sweep(networks):
+    # Turn nested (start, end, property id) networks, already sorted in (start, -end) order, into sorted
+    # non-overlapping ranges where the most specific network wins. Ranges are yielded as the sweep passes them, with a
+    # stack of the networks still open, so the input can be a stream.
+    pending = None
+    stack = []
+    cursor = 0
+
+    def close(limit):
+        # Emit what's left of every open network that ends before limit
+        nonlocal cursor
+        while stack and stack[-1][0] < limit:
+            open_end, open_prop = stack.pop()
+            if cursor <= open_end:
+                yield cursor, open_end, open_prop
+                cursor = open_end + 1
+
+    def ranges():
+        nonlocal cursor
+        for start, end, prop in networks:
+            yield from close(start)
+            if stack and cursor < start:
+                yield cursor, start - 1, stack[-1][1]
+            cursor = start
+            stack.append((end, prop))
+        yield from close(float("inf"))
+
+    # Adjacent ranges with the same properties are coalesced
+    for start, end, prop in ranges():
+        if pending is not None and pending[1] + 1 == start and pending[2] == prop:
+            pending = (pending[0], end, prop)
+        else:
+            if pending is not None:
+                yield pending
+            pending = (start, end, prop)
+    if pending is not None:
+        yield pending
+
+
+def flatten(networks):
+    return list(sweep(sorted(networks, key=lambda network: (network[0], -network[1]))))
+
+
+class SplitColumn:
+    # A column of IPv6 addresses stored as 64-bit halves, read as whole addresses so bisect can search it in place
+    def __init__(self, high, low):
+        self.high = high
+        self.low = low
+
+    def __len__(self):
+        return len(self.high)
+
+    def __getitem__(self, i):
+        return (self.high[i] << 64) | self.low[i]
+
+
+class RangeIndex:
+    # Sorted, non-overlapping start/end ranges per IP version with an interned property id for each
+    def __init__(self, ranges, properties):
+        self.properties = properties
+        self.starts = {}
+        self.ends = {}
+        self.props = {}
+        for version in (4, 6):
+            version_ranges = ranges.get(version, [])
+            self.starts[version] = array("I") if version == 4 else []
+            self.ends[version] = array("I") if version == 4 else []
+            self.props[version] = array("I")
+            for start, end, prop in version_ranges:
+                self.starts[version].append(start)
+                self.ends[version].append(end)
+                self.props[version].append(prop)
+
+    def __len__(self):
+        return len(self.props[4]) + len(self.props[6])
+
+    @classmethod
+    def from_json_files(cls, json_files):
+        properties = []
+        property_ids = {}
+        networks = {4: [], 6: []}
+        for json_file in json_files:
+            store = CidrStore.load(json_file)
+            for row, version, start, prefixlen, property_id in store.rows():
+                entry = store.properties[property_id]
+                key = json.dumps(entry, sort_keys=True, ensure_ascii=False)
+                if key not in property_ids:
+                    property_ids[key] = len(properties)
+                    properties.append(entry)
+                networks[version].append((start, network_end(version, start, prefixlen), property_ids[key]))
+        return cls({version: flatten(items) for version, items in networks.items()}, properties)
+
+    def find(self, version, address):
+        starts = self.starts[version]
+        i = bisect.bisect_right(starts, address) - 1
+        if i >= 0 and address <= self.ends[version][i]:
+            return self.properties[self.props[version][i]]
+        return None
+
+    def lookup_ids(self, addresses):
+        # Resolve (version, integer address) pairs to property ids, or None where nothing matches.
+        # The batch is sorted first so each bisect only searches the part of the index after the previous match.
+        results = [None] * len(addresses)
+        order = sorted(range(len(addresses)), key=addresses.__getitem__)
+        lo = {4: 0, 6: 0}
+        for i in order:
+            version, address = addresses[i]
+            if version not in self.starts:
+                continue
+            position = bisect.bisect_right(self.starts[version], address, lo[version]) - 1
+            if position >= 0:
+                lo[version] = position
+                if address <= self.ends[version][position]:
+                    results[i] = self.props[version][position]
+        return results
+
+    def lookup_batch(self, addresses):
+        return [None if prop is None else self.properties[prop] for prop in self.lookup_ids(addresses)]
+
+    def save(self, index_file, sources=None):
+        # sources identifies the files the index was built from, it's kept in the header for readers to check
+        columns = {
+            "v4_start": self.starts[4],
+            "v4_end": self.ends[4],
+            "v4_props": self.props[4],
+            "v6_start_hi": array("Q", (start >> 64 for start in self.starts[6])),
+            "v6_start_lo": array("Q", (start & LOW_BITS for start in self.starts[6])),
+            "v6_end_hi": array("Q", (end >> 64 for end in self.ends[6])),
+            "v6_end_lo": array("Q", (end & LOW_BITS for end in self.ends[6])),
+            "v6_props": self.props[6],
+        }
+        properties = json.dumps(self.properties, ensure_ascii=False).encode("utf-8")
+
+        header = {"v4_count": len(self.props[4]), "v6_count": len(self.props[6]), "sources": sources, "offsets": {}}
+        body = bytearray()
+        for name, typecode in IPV4_COLUMNS + IPV6_COLUMNS:
+            column = columns[name]
+            if sys.byteorder != "little":
+                column = array(typecode, column)
+                column.byteswap()
+            header["offsets"][name] = len(body)
+            body += column.tobytes()
+            body += b"\x00" * (-len(body) % 8)
+        header["offsets"]["properties"] = len(body)
+        header["properties_length"] = len(properties)
+        body += properties
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        header_bytes += b" " * (-len(header_bytes) % 8)
+
+        # Written under a temporary name first so readers never see a partial index
+        temp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(temp_file, "wb") as file:
+            file.write(INDEX_MAGIC)
+            file.write(struct.pack("<Q", len(header_bytes)))
+            file.write(header_bytes)
+            file.write(body)
+        os.replace(temp_file, index_file)
+
+    @staticmethod
+    def read_header(buffer):
+        if bytes(buffer[:8]) != INDEX_MAGIC:
+            raise ValueError("Not a range index file")
+        (header_length,) = struct.unpack("<Q", buffer[8:16])
+        header = json.loads(bytes(buffer[16 : 16 + header_length]))
+        return header, 16 + header_length
+
+    @classmethod
+    def header(cls, index_file):
+        # Read only the header, without loading any of the columns
+        with open(index_file, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with buffer:
+            return cls.read_header(buffer)[0]
+
+    @classmethod
+    def load(cls, index_file):
+        with open(index_file, "rb") as file:
+            buffer = file.read()
+        header, base = cls.read_header(buffer)
+
+        counts = {"v4": header["v4_count"], "v6": header["v6_count"]}
+        columns = {}
+        for name, typecode in IPV4_COLUMNS + IPV6_COLUMNS:
+            column = array(typecode)
+            start = base + header["offsets"][name]
+            column.frombytes(buffer[start : start + counts[name[:2]] * column.itemsize])
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns[name] = column
+
+        start = base + header["offsets"]["properties"]
+        properties = json.loads(buffer[start : start + header["properties_length"]].decode("utf-8"))
+
+        index = cls({}, properties)
+        index.starts[4], index.ends[4], index.props[4] = columns["v4_start"], columns["v4_end"], columns["v4_props"]
+        index.starts[6] = [(hi << 64) | lo for hi, lo in zip(columns["v6_start_hi"], columns["v6_start_lo"])]
+        index.ends[6] = [(hi << 64) | lo for hi, lo in zip(columns["v6_end_hi"], columns["v6_end_lo"])]
+        index.props[6] = columns["v6_props"]
+        return index
+
+    @classmethod
+    def map(cls, index_file):
+        # Search the columns where they are in a memory-mapped index file instead of copying them, so opening even a
+        # large index is quick and its pages are shared by every process mapping the same file. Only the property
+        # records are decoded.
+        if sys.byteorder != "little":
+            return cls.load(index_file)
+        with open(index_file, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header, base = cls.read_header(buffer)
+        view = memoryview(buffer)
+
+        counts = {"v4": header["v4_count"], "v6": header["v6_count"]}
+        columns = {}
+        for name, typecode in IPV4_COLUMNS + IPV6_COLUMNS:
+            start = base + header["offsets"][name]
+            columns[name] = view[start : start + counts[name[:2]] * array(typecode).itemsize].cast(typecode)
+
+        start = base + header["offsets"]["properties"]
+        properties = json.loads(bytes(view[start : start + header["properties_length"]]).decode("utf-8"))
+
+        index = cls({}, properties)
+        index.starts[4], index.ends[4], index.props[4] = columns["v4_start"], columns["v4_end"], columns["v4_props"]
+        index.starts[6] = SplitColumn(columns["v6_start_hi"], columns["v6_start_lo"])
+        index.ends[6] = SplitColumn(columns["v6_end_hi"], columns["v6_end_lo"])
+        index.props[6] = columns["v6_props"]
+        return index
+
+
+def parse_address(address):
+    # socket's C parsers are far faster than building ipaddress objects for every query
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except OSError:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), "big")
+
+
+def format_address(version, address):
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, address.to_bytes(4, "big"))
+    return socket.inet_ntop(socket.AF_INET6, address.to_bytes(16, "big"))
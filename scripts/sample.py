@@ -0,0 +1,136 @@
+import argparse
+import bisect
+import json
+import random
+import sys
+import time
+from cidrstore import CidrStore, network_end
+from rangeindex import format_address, sweep
+
+STRATEGIES = ["uniform", "boundary", "weighted"]
+
+
+def owned_ranges(store):
+    # The ranges of each CIDR that no more specific CIDR covers, as {row: [(start, end), ...]}. Sweeping with the row
+    # as the property splits every supernet around its subnets, so addresses sampled from these ranges expect exactly
+    # that CIDR's properties.
+    owned = {}
+    for version in (4, 6):
+        networks = sorted(
+            (
+                (start, network_end(version, start, prefixlen), row)
+                for row, row_version, start, prefixlen, _ in store.rows()
+                if row_version == version
+            ),
+            key=lambda network: (network[0], -network[1]),
+        )
+        for start, end, row in sweep(networks):
+            owned.setdefault(row, []).append((start, end))
+    return owned
+
+
+def locate(ranges, offsets, cumulative):
+    # Map offsets into the concatenated ranges back to addresses, cumulative holds the offset each range starts at
+    for offset in offsets:
+        index = bisect.bisect_right(cumulative, offset) - 1
+        yield ranges[index][0] + offset - cumulative[index]
+
+
+def cumulative_offsets(ranges):
+    cumulative = []
+    total = 0
+    for start, end in ranges:
+        cumulative.append(total)
+        total += end - start + 1
+    return cumulative, total
+
+
+def draw_offsets(total, count, rng):
+    # Distinct offsets below total in ascending order, all of them when there are no more than count
+    if total <= count:
+        return range(total)
+    offsets = set()
+    while len(offsets) < count:
+        offsets.add(rng.randrange(total))
+    return sorted(offsets)
+
+
+def sample_uniform(ranges, count, rng):
+    cumulative, total = cumulative_offsets(ranges)
+    return list(locate(ranges, draw_offsets(total, count, rng), cumulative))
+
+
+def sample_boundary(ranges, count):
+    # The first and last address of every owned range, which includes the addresses either side of each subnet
+    edges = []
+    for start, end in ranges:
+        for address in (start, end):
+            if not edges or edges[-1] != address:
+                edges.append(address)
+    return edges[:count]
+
+
+def sample_store(store, strategy, per_cidr, total, rng):
+    # Yield (row, address) pairs in address order
+    owned = owned_ranges(store)
+    rows = sorted(owned, key=lambda row: (store.version[row], store.start(row)))
+
+    if strategy != "weighted":
+        for row in rows:
+            if strategy == "uniform":
+                addresses = sample_uniform(owned[row], per_cidr, rng)
+            else:
+                addresses = sample_boundary(owned[row], per_cidr)
+            for address in addresses:
+                yield row, address
+        return
+
+    # Each IP version's budget is spread across its owned address space, so every address is equally likely
+    for version in (4, 6):
+        version_rows = [row for row in rows if store.version[row] == version]
+        ranges = [(start, end, row) for row in version_rows for start, end in owned[row]]
+        if not ranges:
+            continue
+        cumulative, space = cumulative_offsets([(start, end) for start, end, _ in ranges])
+        for offset in draw_offsets(space, total, rng):
+            index = bisect.bisect_right(cumulative, offset) - 1
+            yield ranges[index][2], ranges[index][0] + offset - cumulative[index]
+
+
+def sample(json_files, output_file, strategy="uniform", per_cidr=4, total=100000, seed=0):
+    start_time = time.time()
+    rng = random.Random(seed)
+    sampled = 0
+    cidrs = 0
+
+    with open(output_file, "w", encoding="utf-8") if output_file != "-" else sys.stdout as output:
+        for json_file in json_files:
+            store = CidrStore.load(json_file)
+            cidrs += len(store)
+            # Each distinct property record is serialised once rather than once per address
+            encoded = {}
+            for row, address in sample_store(store, strategy, per_cidr, total, rng):
+                property_id = store.props[row]
+                if property_id not in encoded:
+                    encoded[property_id] = json.dumps(store.properties[property_id], ensure_ascii=False)
+                output.write(
+                    f'{{"ip": "{format_address(store.version[row], address)}", "cidr": "{store.cidr(row)}", '
+                    f'"properties": {encoded[property_id]}}}\n'
+                )
+                sampled += 1
+
+    elapsed_time = time.time() - start_time
+    print(f"Sampled {sampled:,} addresses from {cidrs:,} CIDRs in {elapsed_time:.2f} seconds", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_files", nargs="+", help="paths to the processed IPv4 and/or IPv6 JSON files")
+    parser.add_argument("--output", default="-", help="path to write the NDJSON test vectors to (defaults to stdout)")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="uniform", help="how addresses are drawn")
+    parser.add_argument("--per-cidr", type=int, default=4, help="addresses per CIDR for uniform and boundary")
+    parser.add_argument("--total", type=int, default=100000, help="addresses per IP version for weighted")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the sampled addresses")
+    args = parser.parse_args()
+
+    sample(args.json_files, args.output, args.strategy, args.per_cidr, args.total, args.seed)
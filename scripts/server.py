@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict
+from rangeindex import RangeIndex, parse_address
+
+# Upper bounds of the request latency histogram, in milliseconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100]
+
+# Longest request line accepted, batches are sent as a single line
+LINE_LIMIT = 16 << 20
+
+MISSING = object()
+
+
+class LruCache:
+    # Bounded cache of address -> encoded properties that evicts the least recently used address first
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def file_identity(index_file):
+    # An index is replaced by renaming a new file over it, which changes the inode even if the mtime doesn't
+    stat = os.stat(index_file)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class MappedIndex:
+    def __init__(self, index_file):
+        # Stat before mapping, so a file replaced in between is picked up again by the next check
+        self.identity = file_identity(index_file)
+        self.index = RangeIndex.map(index_file)
+        self.loaded_at = time.time()
+        # Each distinct property record is serialised once rather than once per lookup
+        self.encoded = {
+            prop: json.dumps(properties, ensure_ascii=False) for prop, properties in enumerate(self.index.properties)
+        }
+        self.encoded[None] = "null"
+
+
+class LookupServer:
+    # Answers lookups from one memory-mapped index at a time. Requests are handled on the event loop without awaiting
+    # between reading the current index and the cache, so swapping both in reload() is atomic for every request.
+    def __init__(self, index_file, cache_size=100000, reload_interval=10):
+        self.index_file = index_file
+        self.reload_interval = reload_interval
+        self.current = MappedIndex(index_file)
+        self.cache = LruCache(cache_size)
+        self.failed_identity = None
+        self.reloads = 0
+        self.requests = 0
+        self.addresses = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def resolve(self, addresses):
+        # Encoded properties for each address, only cache misses are parsed and searched, as one sorted batch
+        current = self.current
+        results = [self.cache.get(address) for address in addresses]
+        misses = [i for i, result in enumerate(results) if result is MISSING]
+        if not misses:
+            return results
+
+        queries = []
+        for i in misses:
+            try:
+                queries.append(parse_address(addresses[i]))
+            except (OSError, ValueError):
+                queries.append((0, -1))  # Invalid addresses never match
+        for i, prop in zip(misses, current.index.lookup_ids(queries)):
+            results[i] = current.encoded[prop]
+            self.cache.put(addresses[i], results[i])
+        return results
+
+    def respond(self, request):
+        if request == "stats":
+            return json.dumps(self.stats())
+
+        if request.startswith("["):
+            addresses = json.loads(request)
+            if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+                raise ValueError("A batch must be a JSON array of addresses")
+        else:
+            addresses = [request]
+
+        records = [
+            f'{{"ip": {json.dumps(address)}, "properties": {properties}}}'
+            for address, properties in zip(addresses, self.resolve(addresses))
+        ]
+        self.addresses += len(addresses)
+        if request.startswith("["):
+            return f"[{', '.join(records)}]"
+        return records[0]
+
+    def observe(self, seconds):
+        milliseconds = seconds * 1000
+        self.requests += 1
+        self.latency_total += milliseconds
+        self.latency_max = max(self.latency_max, milliseconds)
+        for bucket, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                self.latency_counts[bucket] += 1
+                break
+        else:
+            self.latency_counts[-1] += 1
+
+    def stats(self):
+        lookups = self.cache.hits + self.cache.misses
+        buckets = {f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS, self.latency_counts)}
+        buckets[f">{LATENCY_BUCKETS[-1]}"] = self.latency_counts[-1]
+        return {
+            "index": {
+                "file": self.index_file,
+                "ranges": len(self.current.index),
+                "loaded_at": self.current.loaded_at,
+                "reloads": self.reloads,
+            },
+            "requests": self.requests,
+            "addresses": self.addresses,
+            "errors": self.errors,
+            "latency_ms": {
+                "mean": self.latency_total / self.requests if self.requests else None,
+                "max": self.latency_max,
+                "buckets": buckets,
+            },
+            "cache": {
+                "capacity": self.cache.capacity,
+                "size": len(self.cache),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+                "hit_rate": self.cache.hits / lookups if lookups else None,
+            },
+        }
+
+    async def handle(self, reader, writer):
+        # One request per line: an address, a JSON array of addresses, or "stats". Each gets one line back.
+        try:
+            while line := await reader.readline():
+                request = line.decode("utf-8", errors="replace").strip()
+                if not request:
+                    continue
+                start_time = time.perf_counter()
+                try:
+                    response = self.respond(request)
+                except ValueError as e:
+                    self.errors += 1
+                    response = json.dumps({"error": str(e)})
+                self.observe(time.perf_counter() - start_time)
+                writer.write(response.encode("utf-8") + b"\n")
+                await writer.drain()
+        except ValueError:
+            # The line was longer than LINE_LIMIT, the rest of the stream can't be framed so the connection is dropped
+            self.errors += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def reload(self):
+        try:
+            identity = file_identity(self.index_file)
+        except OSError:
+            return
+        if identity in (self.current.identity, self.failed_identity):
+            return
+
+        try:
+            # Mapping and decoding the properties happens off the event loop, requests keep using the old index
+            replacement = await asyncio.to_thread(MappedIndex, self.index_file)
+        except (OSError, ValueError) as e:
+            self.failed_identity = identity
+            print(f"Keeping the current index, {self.index_file} couldn't be loaded: {e}", file=sys.stderr)
+            return
+
+        self.current = replacement
+        self.cache.clear()
+        self.reloads += 1
+        print(f"Reloaded {len(replacement.index):,} ranges from {self.index_file}", file=sys.stderr)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self.reload()
+
+
+async def serve(index_file, host="127.0.0.1", port=8053, socket_path=None, cache_size=100000, reload_interval=10):
+    start_time = time.time()
+    server = LookupServer(index_file, cache_size, reload_interval)
+    print(f"Mapped {len(server.current.index):,} ranges in {time.time() - start_time:.2f} seconds", file=sys.stderr)
+
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle, socket_path, limit=LINE_LIMIT)
+        print(f"Listening on {socket_path}", file=sys.stderr)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port, limit=LINE_LIMIT)
+        print(f"Listening on {host}:{port}", file=sys.stderr)
+
+    # The index file is checked for a new release every reload_interval seconds, SIGHUP checks straight away
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    def reload_now():
+        task = loop.create_task(server.reload())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, reload_now)
+    watcher = loop.create_task(server.watch()) if reload_interval > 0 else None
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if watcher:
+            watcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_file", help="range index written by lookup.py --index")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8053, help="port to listen on")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--cache-size", type=int, default=100000, help="addresses kept in the LRU cache")
+    parser.add_argument("--reload-interval", type=float, default=10, help="seconds between checks for a new index")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.index_file, args.host, args.port, args.socket, args.cache_size, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
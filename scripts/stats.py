@@ -0,0 +1,128 @@
+import argparse
+import json
+from collections import Counter
+from cidrstore import CidrStore, MAX_PREFIXLEN, network_end
+from rangeindex import flatten
+
+VERSION_NAMES = {4: "IPv4", 6: "IPv6"}
+
+
+def coverage(json_files):
+    # Exact address coverage per IP version, country and subdivision from one sweep over each file's networks.
+    # Flattening first means nested networks aren't counted twice and each address is attributed to its most specific
+    # network. Python ints keep the IPv6 sums exact.
+    stats = {}
+    for json_file in json_files:
+        store = CidrStore.load(json_file)
+        networks = {4: [], 6: []}
+        for row, version, start, prefixlen, property_id in store.rows():
+            networks[version].append((start, network_end(version, start, prefixlen), property_id))
+            if version not in stats:
+                stats[version] = {"cidrs": 0, "addresses": 0}
+                for key in ("countries", "subdivisions", "prefixlens"):
+                    stats[version][key] = Counter()
+            version_stats = stats[version]
+            version_stats["cidrs"] += 1
+            version_stats["prefixlens"][prefixlen] += 1
+
+        for version, version_networks in networks.items():
+            for start, end, property_id in flatten(version_networks):
+                size = end - start + 1
+                entry = store.properties[property_id]
+                stats[version]["addresses"] += size
+                stats[version]["countries"][entry.get("country_code") or "??"] += size
+                if entry.get("subdivision_1_iso_code"):
+                    stats[version]["subdivisions"][entry["subdivision_1_iso_code"]] += size
+    return stats
+
+
+def source_coverage(store):
+    # CIDRs and addresses asserted by each source of a merged store, from its source bitmasks. Networks are nested or
+    # disjoint, so in address order a source's network either starts past everything it covered so far or lies inside
+    # one of its earlier networks.
+    covered_until = {}
+    totals = {name: [0, 0] for name in store.source_names}
+    for row in sorted(range(len(store)), key=lambda row: (store.version[row], store.start(row), store.prefixlen[row])):
+        version = store.version[row]
+        start = store.start(row)
+        end = store.end(row)
+        for name in store.row_sources(row):
+            totals[name][0] += 1
+            previous = covered_until.get(name)
+            if previous is None or previous[0] != version or start > previous[1]:
+                totals[name][1] += end - start + 1
+                covered_until[name] = (version, end)
+    return totals
+
+
+def format_addresses(version, addresses):
+    # Large IPv6 coverage is shown in /64s, an exact count of addresses would be unreadable
+    if version == 4 or addresses < 1 << 64:
+        return f"{addresses:,}"
+    return f"{addresses / (1 << 64):,.1f} /64s"
+
+
+def share(version, addresses):
+    return f"{addresses / (1 << MAX_PREFIXLEN[version]):.4%}"
+
+
+def render(stats, source_stats=None, top=20):
+    lines = []
+    for version, version_stats in sorted(stats.items()):
+        name = VERSION_NAMES[version]
+        lines.append(f"\n### {name}\n")
+        lines.append(
+            f"{version_stats['cidrs']:,} CIDRs covering {format_addresses(version, version_stats['addresses'])} "
+            f"({share(version, version_stats['addresses'])} of the address space)."
+        )
+
+        for title, counter in (("Country", version_stats["countries"]), ("Subdivision", version_stats["subdivisions"])):
+            if not counter:
+                continue
+            lines.append(f"\n| {title} | Addresses | Share |")
+            lines.append("| --- | --- | --- |")
+            for key, addresses in counter.most_common(top):
+                lines.append(
+                    f"| {key} | {format_addresses(version, addresses)} | {addresses / version_stats['addresses']:.2%} |"
+                )
+            if len(counter) > top:
+                lines.append(f"| {len(counter) - top:,} more | | |")
+
+        lines.append("\n| Prefix length | CIDRs |")
+        lines.append("| --- | --- |")
+        for prefixlen, count in sorted(version_stats["prefixlens"].items()):
+            lines.append(f"| /{prefixlen} | {count:,} |")
+
+        if source_stats and name in source_stats:
+            lines.append("\n| Source | CIDRs | Addresses |")
+            lines.append("| --- | --- | --- |")
+            for source, (cidrs, addresses) in source_stats[name].items():
+                lines.append(f"| {source} | {cidrs:,} | {format_addresses(version, int(addresses))} |")
+
+    return "\n".join(lines)
+
+
+def save_source_stats(stores, stats_file):
+    # Written with the standard library, IPv6 address counts don't fit the 64-bit integers faster parsers accept
+    with open(stats_file, "w", encoding="utf-8") as file:
+        json.dump(
+            {VERSION_NAMES[version]: source_coverage(store) for version, store in stores.items()},
+            file,
+            indent=0,
+            ensure_ascii=False,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_files", nargs="+", help="paths to the processed IPv4 and/or IPv6 JSON files")
+    parser.add_argument("--sources", help="per-source coverage written by build.py --source-stats")
+    parser.add_argument("--top", type=int, default=20, help="countries and subdivisions listed per IP version")
+    args = parser.parse_args()
+
+    source_stats = None
+    if args.sources:
+        with open(args.sources, "r", encoding="utf-8") as file:
+            source_stats = json.load(file)
+
+    print(render(coverage(args.json_files), source_stats, args.top))